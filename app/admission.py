@@ -0,0 +1,148 @@
+import asyncio
+import json
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from app.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Admission control for the chat endpoints
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "5"))
+ADMISSION_PATHS = tuple(os.getenv("ADMISSION_PATHS", "/chat,/chat/stream,/chat/batch").split(","))
+
+
+class AdmissionController:
+    """Bounded admission: a fixed number of running requests plus a bounded wait queue.
+    
+    Requests beyond the queue depth, or waiting longer than max_wait_seconds,
+    are rejected with a Retry-After estimate instead of piling up.
+    """
+    
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE,
+                 max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_wait_timeout = 0
+        self._service_seconds = 1.0  # moving average of time a request holds a slot
+    
+    def retry_after(self):
+        """Seconds until a slot is likely free, from the queue depth and recent service time."""
+        backlog = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(backlog * self._service_seconds))
+    
+    async def acquire(self):
+        """Wait for a slot. Returns None when admitted, else the rejection reason."""
+        if self.waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            return "queue_full"
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            self.rejected_wait_timeout += 1
+            return "wait_timeout"
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        return None
+    
+    def release(self, held_seconds):
+        self.active -= 1
+        self._service_seconds += 0.1 * (held_seconds - self._service_seconds)
+        self._semaphore.release()
+    
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait_seconds,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_wait_timeout": self.rejected_wait_timeout,
+            "average_service_seconds": self._service_seconds
+        }
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying admission control to the chat endpoints.
+    
+    The slot is held until the response (including a streamed body) has been
+    sent, and released even if the client disconnects.
+    """
+    
+    def __init__(self, app, controller=admission, paths=ADMISSION_PATHS):
+        self.app = app
+        self.controller = controller
+        self.paths = paths
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        reason = await self.controller.acquire()
+        if reason is not None:
+            retry_after = self.controller.retry_after()
+            logger.warning(f"Rejected {scope['path']} ({reason}); retry after {retry_after}s")
+            body = json.dumps({"detail": "Server is overloaded, please retry later", "reason": reason}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(retry_after).encode()),
+                    (b"content-length", str(len(body)).encode())
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.monotonic() - start)
+
+
+class SessionLocks:
+    """One asyncio lock per active session, dropped when no request holds or awaits it."""
+    
+    def __init__(self):
+        self._locks = {}  # session_id -> [lock, users]
+    
+    @asynccontextmanager
+    async def hold(self, session_id):
+        """Run the block with the session's turns serialized."""
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+    
+    def __len__(self):
+        return len(self._locks)
+
+
+session_locks = SessionLocks()
@@ -0,0 +1,350 @@
+import asyncio
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from app.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Exact-match LLM response cache
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt_text):
+    """Collapse runs of whitespace so formatting differences share a cache entry."""
+    return _WHITESPACE_RE.sub(" ", prompt_text).strip()
+
+
+def cache_key(model_name, variant, prompt_text):
+    """Hash of the model, prompt variant and normalized formatted prompt."""
+    raw = f"{model_name}\0{variant}\0{normalize_prompt(prompt_text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of LLM responses with a per-entry TTL.
+    
+    Expired entries miss but stay until LRU eviction or overwrite, so
+    get_stale() can still serve them while the LLM is unavailable.
+    """
+    
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS, enabled=LLM_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries = OrderedDict()  # key -> (expires_at, response_text), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+    
+    def get(self, key):
+        """Return the cached response for key, or None."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def get_stale(self, key):
+        """Return the cached response for key even if it has expired, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry[1]
+    
+    def set(self, key, response_text):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, response_text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions
+            }
+
+
+response_cache = ResponseCache()
+
+
+# Near-duplicate (MinHash/LSH) cache for first-turn prompts
+LLM_FUZZY_CACHE_ENABLED = os.getenv("LLM_FUZZY_CACHE_ENABLED", "false").lower() == "true"
+LLM_FUZZY_CACHE_THRESHOLD = float(os.getenv("LLM_FUZZY_CACHE_THRESHOLD", "0.85"))
+LLM_FUZZY_CACHE_MAX_ENTRIES = int(os.getenv("LLM_FUZZY_CACHE_MAX_ENTRIES", "2048"))
+LLM_FUZZY_CACHE_MAX_CHARS = int(os.getenv("LLM_FUZZY_CACHE_MAX_CHARS", "2000"))
+
+_MINHASH_PERMUTATIONS = 64
+_LSH_BANDS = 16  # 16 bands x 4 rows: pairs above ~0.5 similarity become candidates
+_MERSENNE_PRIME = (1 << 31) - 1
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_CONTRACTIONS = {
+    "what's": "what is", "who's": "who is", "where's": "where is", "how's": "how is",
+    "when's": "when is", "why's": "why is", "it's": "it is", "that's": "that is",
+    "there's": "there is", "i'm": "i am", "you're": "you are", "they're": "they are",
+    "we're": "we are", "isn't": "is not", "aren't": "are not", "don't": "do not",
+    "doesn't": "does not", "can't": "cannot", "won't": "will not",
+}
+
+
+def _permutations():
+    # A fixed seed keeps signatures stable across processes.
+    rng = random.Random(1301)
+    return [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(_MINHASH_PERMUTATIONS)]
+
+
+_PERMUTATIONS = _permutations()
+_permutation_columns = None  # (a, b) as NumPy columns, built on first use
+
+
+def shingles(text, max_chars=LLM_FUZZY_CACHE_MAX_CHARS):
+    """Character 3-gram shingles of a lowercased, punctuation-free prompt.
+    
+    Only the first max_chars characters of the prompt are shingled.
+    """
+    words = text[:max_chars].lower().replace("’", "'").split()
+    words = [_CONTRACTIONS.get(word, word) for word in words]
+    text = " ".join(_PUNCTUATION_RE.sub("", " ".join(words)).split())
+    if len(text) < 3:
+        return frozenset([text])
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def minhash(shingle_set):
+    """MinHash signature of a shingle set."""
+    global _permutation_columns
+    import numpy as np  # deferred: only the fuzzy cache needs it
+    
+    if _permutation_columns is None:
+        permutations = np.array(_PERMUTATIONS, dtype=np.uint64)
+        _permutation_columns = (permutations[:, :1], permutations[:, 1:])
+    a, b = _permutation_columns
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set), dtype=np.uint64, count=len(shingle_set))
+    # a < 2**31 and hashes < 2**32, so a * h + b stays below 2**64
+    return tuple(((a * hashes + b) % np.uint64(_MERSENNE_PRIME)).min(axis=1).tolist())
+
+
+class _FuzzyEntry:
+    __slots__ = ("variant", "shingles", "bands", "response", "expires_at")
+    
+    def __init__(self, variant, shingle_set, bands, response, expires_at):
+        self.variant = variant
+        self.shingles = shingle_set
+        self.bands = bands
+        self.response = response
+        self.expires_at = expires_at
+
+
+class FuzzyCache:
+    """Near-duplicate prompt cache backed by an in-memory MinHash LSH index.
+    
+    Prompts are indexed per variant. LSH band buckets give candidates and the
+    exact Jaccard similarity of their shingle sets decides a hit, so no
+    embedding service is needed.
+    """
+    
+    def __init__(self, threshold=LLM_FUZZY_CACHE_THRESHOLD, max_entries=LLM_FUZZY_CACHE_MAX_ENTRIES,
+                 ttl_seconds=LLM_CACHE_TTL_SECONDS, enabled=LLM_FUZZY_CACHE_ENABLED):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries = OrderedDict()  # entry id -> _FuzzyEntry, least recently used first
+        self._buckets = {}  # (variant, band index, band values) -> set of entry ids
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def _bands(signature):
+        rows = len(signature) // _LSH_BANDS
+        return [signature[i * rows:(i + 1) * rows] for i in range(_LSH_BANDS)]
+    
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for band_index, band in enumerate(entry.bands):
+            bucket_key = (entry.variant, band_index, band)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[bucket_key]
+    
+    def signature(self, prompt_text):
+        """Return the (shingles, LSH bands) of prompt_text for get() and set(), or None if disabled.
+        
+        A request computes it once and passes it from its lookup to its store.
+        """
+        if not self.enabled:
+            return None
+        shingle_set = shingles(prompt_text)
+        return shingle_set, self._bands(minhash(shingle_set))
+    
+    def get(self, variant, signature):
+        """Return a stored response for a prompt similar to the signed one, or None."""
+        if signature is None:
+            return None
+        shingle_set, bands = signature
+        now = time.monotonic()
+        with self._lock:
+            candidates = set()
+            for band_index, band in enumerate(bands):
+                candidates.update(self._buckets.get((variant, band_index, band), ()))
+            
+            best_id, best_score = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry.expires_at < now:
+                    self._remove(entry_id)
+                    self.evictions += 1
+                    continue
+                score = len(shingle_set & entry.shingles) / len(shingle_set | entry.shingles)
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+            
+            if best_id is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            logger.info(f"Fuzzy cache hit for variant '{variant}' (similarity {best_score:.2f})")
+            return self._entries[best_id].response
+    
+    def set(self, variant, signature, response_text):
+        if signature is None:
+            return
+        shingle_set, bands = signature
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _FuzzyEntry(
+                variant, shingle_set, bands, response_text, time.monotonic() + self.ttl_seconds
+            )
+            for band_index, band in enumerate(bands):
+                self._buckets.setdefault((variant, band_index, band), set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+
+fuzzy_cache = FuzzyCache()
+
+
+# Coalescing of concurrent identical LLM calls
+LLM_SINGLE_FLIGHT_ENABLED = os.getenv("LLM_SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+
+class SingleFlight:
+    """Let concurrent calls with the same key share one upstream request.
+    
+    The first caller (the leader) starts the call as its own task; callers
+    arriving while it runs await the same task. The task is shielded, so a
+    caller that disconnects does not cancel the call for the others.
+    """
+    
+    def __init__(self, enabled=LLM_SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._calls = {}  # (event loop, key) -> asyncio.Task
+        self.leaders = 0
+        self.coalesced = 0
+    
+    def _forget(self, flight_key, task):
+        if self._calls.get(flight_key) is task:
+            del self._calls[flight_key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
+    
+    def in_flight(self, key):
+        """Return the running task for key, or None."""
+        if not self.enabled:
+            return None
+        task = self._calls.get((asyncio.get_running_loop(), key))
+        if task is not None:
+            self.coalesced += 1
+        return task
+    
+    async def run(self, key, call):
+        """Await call() once per key at a time; concurrent callers share its result."""
+        if not self.enabled:
+            return await call()
+        flight_key = (asyncio.get_running_loop(), key)
+        task = self._calls.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._calls[flight_key] = task
+            task.add_done_callback(lambda done: self._forget(flight_key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            logger.info("Coalesced LLM call onto an in-flight request")
+        return await asyncio.shield(task)
+    
+    def stats(self):
+        calls = self.leaders + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._calls),
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesce_rate": self.coalesced / calls if calls else 0.0
+        }
+
+
+single_flight = SingleFlight()
@@ -1,46 +1,349 @@
+import ast
+import math
+import operator
+import os
 import re
+import time
+from functools import lru_cache
 from app.logging_utils import setup_logger
+from app.tokenizer import tokenize
 
 logger = setup_logger(__name__)
 
+# Cost limits for a single expression
+CALC_MAX_EXPONENT = int(os.getenv("CALC_MAX_EXPONENT", "10000"))
+CALC_MAX_DIGITS = int(os.getenv("CALC_MAX_DIGITS", "1000"))
+CALC_MAX_NODES = int(os.getenv("CALC_MAX_NODES", "200"))
+CALC_TIMEOUT_MS = float(os.getenv("CALC_TIMEOUT_MS", "50"))
+CALC_CACHE_SIZE = int(os.getenv("CALC_CACHE_SIZE", "1024"))
+
+# Batch evaluation: smaller groups of same-shaped expressions are evaluated one by one
+CALC_BATCH_MIN_GROUP = int(os.getenv("CALC_BATCH_MIN_GROUP", "16"))
+
+_MAX_INT_BITS = int(CALC_MAX_DIGITS * math.log2(10)) + 1
+_EXPRESSION_RE = re.compile(r"^[\d\.\+\-\*/%\(\)\.]+$")
+# Batch shapes: float literals become "f", integer literals int64 holds exactly
+# (no leading zeros, at most 18 digits) become "i"; any other digits stay.
+_FLOAT_LITERAL_RE = re.compile(r"\d+\.\d*|\.\d+")
+_INT_LITERAL_RE = re.compile(r"[1-9]\d{0,17}|0")
+_LITERAL_RE = re.compile(r"\d+\.\d*|\.\d+|[1-9]\d{0,17}|0")
+
+# Integer rows whose values reach this are handed back to the scalar engine,
+# so int64 arithmetic never overflows where Python ints would not.
+_VECTOR_INT_LIMIT = 2 ** 62
+_VECTOR_EXACT_FLOAT_INT = 2 ** 53
+
+
+class CalculationLimitError(ValueError):
+    """Raised when an expression exceeds a calculator cost limit."""
+
+
+def _check_int(value):
+    if type(value) is int and value.bit_length() > _MAX_INT_BITS:
+        raise CalculationLimitError(f"Result exceeds {CALC_MAX_DIGITS} digits")
+    return value
+
+
+def _check_deadline(deadline):
+    if time.perf_counter() > deadline:
+        raise CalculationLimitError(f"Calculation exceeded {CALC_TIMEOUT_MS:.0f}ms")
+
+
+def _safe_mul(a, b):
+    if type(a) is int and type(b) is int and a.bit_length() + b.bit_length() > _MAX_INT_BITS + 1:
+        raise CalculationLimitError(f"Result exceeds {CALC_MAX_DIGITS} digits")
+    return a * b
+
+
+def _safe_pow(a, b):
+    # Only integer powers are expensive; float powers overflow immediately.
+    if type(a) is int and type(b) is int and b > 0 and abs(a) > 1:
+        if b > CALC_MAX_EXPONENT:
+            raise CalculationLimitError(f"Exponent exceeds {CALC_MAX_EXPONENT}")
+        if (a.bit_length() - 1) * b > _MAX_INT_BITS:
+            raise CalculationLimitError(f"Result exceeds {CALC_MAX_DIGITS} digits")
+    return a ** b
+
+
+_BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: _safe_mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _safe_pow,
+}
+
+_UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+def _compile_node(node):
+    """Turn an expression AST node into a closure taking a deadline."""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        value = _check_int(node.value)
+        return lambda deadline: value
+    
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        op = _BINARY_OPS[type(node.op)]
+        left = _compile_node(node.left)
+        right = _compile_node(node.right)
+        
+        def binary(deadline):
+            a = left(deadline)
+            b = right(deadline)
+            _check_deadline(deadline)
+            return _check_int(op(a, b))
+        return binary
+    
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        op = _UNARY_OPS[type(node.op)]
+        operand = _compile_node(node.operand)
+        return lambda deadline: op(operand(deadline))
+    
+    raise ValueError(f"Unsupported expression element: {type(node).__name__}")
+
+
+@lru_cache(maxsize=CALC_CACHE_SIZE)
+def compile_expression(expression):
+    """Parse and compile an expression (spaces already removed). Results are memoized."""
+    tree = ast.parse(expression, mode="eval")
+    node_count = sum(1 for _ in ast.walk(tree))
+    if node_count > CALC_MAX_NODES:
+        raise CalculationLimitError(f"Expression has {node_count} nodes (limit {CALC_MAX_NODES})")
+    return _compile_node(tree.body)
+
 
 def is_math_expression(text):
     """Check if text is a math expression."""
     # Simple heuristic: contains numbers + operators
-    has_numbers = any(c.isdigit() for c in text)
-    has_operators = any(op in text for op in ['+', '-', '*', '/', '%', '**'])
-    return has_numbers and has_operators
+    tokens = tokenize(text)
+    return tokens.has_digits and tokens.has_operator
 
 
-def evaluate_expression(text):
-    """Safely evaluate a math expression."""
+def _evaluate(expression, log=True):
+    """Evaluate a validated expression (spaces removed) within the cost limits."""
     try:
-        # Remove spaces
-        text = text.replace(" ", "")
-        
-        # Only allow numbers, operators, and parentheses
-        if not re.match(r"^[\d\.\+\-\*/%\(\)\.]+$", text):
-            logger.warning(f"Invalid expression format: {text}")
-            return None
-        
-        # Evaluate
-        result = eval(text)
-        logger.info(f"Evaluated: {text} = {result}")
+        evaluate = compile_expression(expression)
+        result = evaluate(time.perf_counter() + CALC_TIMEOUT_MS / 1000)
+        if log:
+            logger.info(f"Evaluated: {expression} = {result}")
         return result
     except Exception as e:
-        logger.error(f"Calculation error: {e}")
+        if log:
+            logger.error(f"Calculation error: {e}")
         return None
 
 
-def calculate(user_input):
-    """Process a math calculation request."""
-    if not is_math_expression(user_input):
+def evaluate_expression(text):
+    """Safely evaluate a math expression."""
+    # Remove spaces
+    text = text.replace(" ", "")
+    
+    # Only allow numbers, operators, and parentheses
+    if not _EXPRESSION_RE.match(text):
+        logger.warning(f"Invalid expression format: {text}")
         return None
     
-    # Extract numbers and operators
-    result = evaluate_expression(user_input)
+    return _evaluate(text)
+
+
+def evaluate_tokens(tokens):
+    """Evaluate a message already tokenized by app.tokenizer, without scanning it again."""
+    if tokens.expression is None:
+        logger.warning("Invalid expression format")
+        return None
+    return _evaluate(tokens.expression)
+
+
+def calculate(user_input, tokens=None):
+    """Process a math calculation request. Pass tokens to reuse the router's tokenization."""
+    if tokens is None:
+        tokens = tokenize(user_input)
+    if not (tokens.has_digits and tokens.has_operator):
+        return None
+    
+    # Evaluate the expression tokens
+    result = evaluate_tokens(tokens)
     
     if result is not None:
         return f"The result is {result}"
     else:
         return "I couldn't calculate that. Please try a valid math expression."
+
+
+class _Rows:
+    """Per-row flags while evaluating a group: rows to re-run one by one, rows that divide by zero."""
+    
+    __slots__ = ("scalar", "failed")
+    
+    def __init__(self, scalar, failed):
+        self.scalar = scalar
+        self.failed = failed
+
+
+def _vector_node(node, kinds):
+    """Turn a template AST node into (kind, fn) with fn(np, columns, rows) -> array; kind is "i" or "f"."""
+    if isinstance(node, ast.Name) and node.id[1:].isdigit() and int(node.id[1:]) < len(kinds):
+        index = int(node.id[1:])
+        return kinds[index], lambda np, columns, rows: columns[index]
+    
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        kind, operand = _vector_node(node.operand, kinds)
+        if isinstance(node.op, ast.USub):
+            return kind, lambda np, columns, rows: -operand(np, columns, rows)
+        return kind, operand
+    
+    if not (isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS):
+        raise ValueError(f"Unsupported expression element: {type(node).__name__}")
+    
+    op = type(node.op)
+    left_kind, left = _vector_node(node.left, kinds)
+    right_kind, right = _vector_node(node.right, kinds)
+    is_float = "f" in (left_kind, right_kind)
+    if op is ast.Pow and is_float:
+        # Float powers can overflow (an error in Python) or turn complex; left to the scalar engine
+        raise ValueError("Float power")
+    
+    def binary(np, columns, rows):
+        a = left(np, columns, rows)
+        b = right(np, columns, rows)
+        if op in (ast.Div, ast.FloorDiv, ast.Mod):
+            zero = b == 0
+            rows.failed |= zero
+            b = np.where(zero, 1, b)
+        if is_float:
+            a = a.astype(np.float64, copy=False)
+            b = b.astype(np.float64, copy=False)
+            if op is ast.Add:
+                return a + b
+            if op is ast.Sub:
+                return a - b
+            if op is ast.Mult:
+                return a * b
+            if op is ast.Div:
+                return a / b
+            if op is ast.FloorDiv:
+                return np.floor_divide(a, b)
+            return np.remainder(a, b)
+        
+        if op is ast.Div:
+            # int / int is a correctly rounded float only while both fit a float exactly
+            rows.scalar |= (np.abs(a) > _VECTOR_EXACT_FLOAT_INT) | (np.abs(b) > _VECTOR_EXACT_FLOAT_INT)
+            return a.astype(np.float64) / b.astype(np.float64)
+        if op in (ast.Add, ast.Sub):
+            overflow = np.abs(a) + np.abs(b) >= _VECTOR_INT_LIMIT
+            result = a + b if op is ast.Add else a - b
+        elif op is ast.Mult:
+            overflow = np.abs(a).astype(np.float64) * np.abs(b).astype(np.float64) >= _VECTOR_INT_LIMIT
+            result = a * b
+        elif op is ast.Pow:
+            # Negative exponents give floats (or divide by zero); huge results need Python ints
+            overflow = (b < 0) | (np.abs(a).astype(np.float64) ** b.astype(np.float64) >= _VECTOR_INT_LIMIT)
+            result = np.power(a, np.where(overflow, 0, b))
+        elif op is ast.FloorDiv:
+            return np.floor_divide(a, b)
+        else:
+            return np.remainder(a, b)
+        rows.scalar |= overflow
+        # Keep out-of-range rows at zero so later steps stay in range too
+        return np.where(overflow, 0, result)
+    
+    return "f" if is_float or op is ast.Div else "i", binary
+
+
+@lru_cache(maxsize=CALC_CACHE_SIZE)
+def _vector_plan(shape):
+    """Compile an expression shape for whole columns: (literal kinds, fn), or None if unsupported."""
+    kinds = ""
+    source = []
+    for char in shape:
+        if char in "fi":
+            source.append(f"x{len(kinds)}")
+            kinds += char
+        else:
+            source.append(char)
+    if not kinds:
+        return None
+    try:
+        tree = ast.parse("".join(source), mode="eval")
+        node_count = sum(1 for node in ast.walk(tree) if not isinstance(node, ast.expr_context))
+        if node_count > CALC_MAX_NODES:
+            return None
+        return kinds, _vector_node(tree.body, kinds)[1]
+    except (SyntaxError, ValueError):
+        return None
+
+
+def evaluate_batch(expressions, min_group=CALC_BATCH_MIN_GROUP):
+    """Evaluate many expressions; returns (results in input order, stats).
+    
+    Each result equals evaluate_expression() for the same text (None where it
+    fails), which may be an int, a float or, for fractional powers of
+    negative numbers, a complex number; see batch_result_json(). Expressions are grouped by shape (operators, parentheses and
+    int/float literals) and each group of at least min_group is evaluated
+    with NumPy column operations; rows that could overflow int64 or lose
+    precision, and everything else unusual, are evaluated one by one.
+    """
+    import numpy as np  # deferred: only batch requests need it
+    
+    results = [None] * len(expressions)
+    groups = {}  # shape -> (indices, literals of all rows, flattened)
+    scalar = []
+    for index, text in enumerate(expressions):
+        text = text.replace(" ", "")
+        if not _EXPRESSION_RE.match(text):
+            scalar.append(index)
+            continue
+        shape = _INT_LITERAL_RE.sub("i", _FLOAT_LITERAL_RE.sub("f", text))
+        group = groups.get(shape)
+        if group is None:
+            group = groups[shape] = ([], [])
+        group[0].append(index)
+        group[1].extend(_LITERAL_RE.findall(text))
+    
+    vectorized = 0
+    vector_groups = 0
+    for shape, (indices, literals) in groups.items():
+        plan = _vector_plan(shape) if len(indices) >= min_group else None
+        if plan is None or len(literals) != len(plan[0]) * len(indices):
+            scalar.extend(indices)
+            continue
+        kinds, evaluate = plan
+        columns = [
+            np.fromiter(map(float if kind == "f" else int, literals[position::len(kinds)]),
+                        np.float64 if kind == "f" else np.int64, len(indices))
+            for position, kind in enumerate(kinds)
+        ]
+        rows = _Rows(np.zeros(len(indices), dtype=bool), np.zeros(len(indices), dtype=bool))
+        with np.errstate(all="ignore"):
+            values = evaluate(np, columns, rows).tolist()
+        rescan = rows.scalar.tolist()
+        failed = rows.failed.tolist()
+        for position, index in enumerate(indices):
+            if rescan[position]:
+                scalar.append(index)
+                continue
+            if not failed[position]:
+                results[index] = values[position]
+            vectorized += 1
+        vector_groups += 1
+    
+    # One log line per batch, not per expression
+    for index in scalar:
+        text = expressions[index].replace(" ", "")
+        results[index] = _evaluate(text, log=False) if _EXPRESSION_RE.match(text) else None
+    
+    stats = {"items": len(expressions), "groups": vector_groups, "vectorized": vectorized, "scalar": len(scalar)}
+    logger.info(f"Batch evaluated: {stats}")
+    return results, stats
+
+
+def batch_result_json(value):
+    """A batch result as a JSON value: ints and finite floats as numbers, anything else (inf, nan, complex) as its string."""
+    if value is None or type(value) is int or (type(value) is float and math.isfinite(value)):
+        return value
+    return str(value)
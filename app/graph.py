@@ -1,12 +1,23 @@
+import os
+import threading
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph
 from typing_extensions import TypedDict
-from app.llm import create_llm_chain
+from app.llm import BUSY_RESPONSE, get_chain
 from app.calculator import calculate
-from app.memory import get_or_create_memory, add_to_memory, get_memory_context
+from app.tokenizer import MessageTokens, tokenize
+from app.memory import add_to_memory, aget_memory_context
+from app.resilience import CircuitOpenError
+from app.tracing import traced
 from app.logging_utils import setup_logger
 
 logger = setup_logger(__name__)
 
+# "direct" calls the nodes with plain function calls (see DirectDispatcher);
+# "langgraph" runs requests through the compiled StateGraph, whose per-step
+# callback and state bookkeeping runs on the event loop
+GRAPH_DISPATCH = os.getenv("GRAPH_DISPATCH", "direct")
+
 
 class ChatState(TypedDict):
     """State passed through the graph."""
@@ -15,25 +26,29 @@ class ChatState(TypedDict):
     response: str
     route: str
     prompt_variant: str  # Added for prompt variant selection
+    use_cache: bool  # Allow cached LLM responses for this request
+    tokens: MessageTokens  # Set by the router, reused by the calculator
+    deadline: float  # time.monotonic() by which the LLM must have answered
 
 
+@traced()
 def router_node(state: ChatState) -> ChatState:
     """Route to calculator or LLM based on content."""
-    message = state["message"].lower()
     session_id = state["session_id"]
     
-    # Check if it's a math expression
-    if any(op in message for op in ['+', '-', '*', '/', '%', '**']):
-        if any(char.isdigit() for char in message):
-            state["route"] = "calculator"
-            logger.info(f"[{session_id}] ROUTER DECISION: Calculator Node | Input: '{state['message']}'")
-            return state
+    # One tokenizer pass decides the route; the calculator reuses the tokens
+    tokens = tokenize(state["message"])
+    state["tokens"] = tokens
+    state["route"] = tokens.route
     
-    state["route"] = "llm"
-    logger.info(f"[{session_id}] ROUTER DECISION: LLM Node | Input: '{state['message']}'")
+    if tokens.route == "calculator":
+        logger.info(f"[{session_id}] ROUTER DECISION: Calculator Node | Input: '{state['message']}'")
+    else:
+        logger.info(f"[{session_id}] ROUTER DECISION: LLM Node | Input: '{state['message']}'")
     return state
 
 
+@traced()
 def calculator_node(state: ChatState) -> ChatState:
     """Process math expressions."""
     session_id = state["session_id"]
@@ -41,7 +56,7 @@ def calculator_node(state: ChatState) -> ChatState:
     
     logger.info(f"[{session_id}] CALCULATOR NODE PROCESSING: '{message}'")
     
-    result = calculate(message)
+    result = calculate(message, state.get("tokens"))
     if result:
         state["response"] = result
         logger.info(f"[{session_id}] CALCULATOR NODE OUTPUT: {result}")
@@ -52,16 +67,19 @@ def calculator_node(state: ChatState) -> ChatState:
     return state
 
 
-def llm_node(state: ChatState) -> ChatState:
-    """Generate response using LLM with memory."""
+async def _build_llm_input(state: ChatState):
+    """Build the LLM input for a turn, including conversation history.
+    
+    Returns (input_text, fuzzy_text); fuzzy_text is the user message on a
+    first turn (eligible for the near-duplicate cache) and None otherwise.
+    """
     session_id = state["session_id"]
     user_message = state["message"]
     prompt_variant = state.get("prompt_variant", "professional")  # Default to professional
     
     logger.info(f"[{session_id}] LLM NODE PROCESSING: '{user_message}' | Prompt Variant: {prompt_variant}")
     
-    memory = get_or_create_memory(session_id)
-    memory_context = get_memory_context(session_id)
+    memory_context = await aget_memory_context(session_id)
     
     if memory_context:
         logger.info(f"[{session_id}] LLM NODE: Using conversation history (memory active)")
@@ -71,26 +89,45 @@ def llm_node(state: ChatState) -> ChatState:
     if memory_context:
         input_text = f"Previous context:\n{memory_context}\n\nNew message: {user_message}"
     
-    # Create chain with selected prompt variant
-    from app.llm import get_llm, get_prompt_template
-    llm = get_llm()
-    prompt = get_prompt_template(prompt_variant)
+    return input_text, None if memory_context else user_message
+
+
+def _finish_llm_turn(state: ChatState, response_text: str) -> ChatState:
+    """Save a completed LLM turn to memory and the state."""
+    session_id = state["session_id"]
+    
+    logger.info(f"[{session_id}] LLM NODE OUTPUT: {response_text[:150]}...")
+    
+    # Save to memory
+    add_to_memory(session_id, state["message"], response_text)
+    logger.info(f"[{session_id}] LLM NODE: Saved to conversation memory")
+    
+    state["response"] = response_text
     
-    # Create the chain
-    class PromptLLMChain:
-        def __init__(self, prompt_template, llm_model):
-            self.prompt_template = prompt_template
-            self.llm_model = llm_model
-        
-        def invoke(self, inputs):
-            formatted_prompt = self.prompt_template.format(**inputs)
-            response = self.llm_model.invoke({"input": formatted_prompt})
-            return response
+    return state
+
+
+def _busy_turn(state: ChatState) -> ChatState:
+    """Answer with the busy reply; the turn is not saved to memory."""
+    logger.warning(f"[{state['session_id']}] LLM NODE: Circuit open, answering with busy reply")
+    state["response"] = BUSY_RESPONSE
+    return state
+
+
+@traced()
+async def llm_node(state: ChatState) -> ChatState:
+    """Generate response using LLM with memory."""
+    input_text, fuzzy_text = await _build_llm_input(state)
     
-    chain = PromptLLMChain(prompt, llm)
+    # Reuse the pre-built chain for the selected prompt variant
+    chain = get_chain(state.get("prompt_variant", "professional"))
     
-    logger.info(f"[{session_id}] LLM NODE: Calling Google Gemini API...")
-    response = chain.invoke({"input": input_text})
+    logger.info(f"[{state['session_id']}] LLM NODE: Calling Google Gemini API...")
+    try:
+        response = await chain.ainvoke({"input": input_text}, use_cache=state.get("use_cache", True), fuzzy_text=fuzzy_text,
+                                       deadline=state.get("deadline"))
+    except CircuitOpenError:
+        return _busy_turn(state)
     
     # Extract text from response
     if hasattr(response, 'content'):
@@ -98,15 +135,57 @@ def llm_node(state: ChatState) -> ChatState:
     else:
         response_text = str(response)
     
-    logger.info(f"[{session_id}] LLM NODE OUTPUT: {response_text[:150]}...")
+    return _finish_llm_turn(state, response_text)
+
+
+@traced()
+async def llm_node_stream(state: ChatState):
+    """Stream an LLM response chunk by chunk; memory is saved once the stream completes."""
+    input_text, fuzzy_text = await _build_llm_input(state)
+    chain = get_chain(state.get("prompt_variant", "professional"))
     
-    # Save to memory
-    add_to_memory(session_id, user_message, response_text)
-    logger.info(f"[{session_id}] LLM NODE: Saved to conversation memory")
+    logger.info(f"[{state['session_id']}] LLM NODE: Streaming from Google Gemini API...")
+    chunks = []
+    try:
+        async for chunk in chain.astream({"input": input_text}, use_cache=state.get("use_cache", True), fuzzy_text=fuzzy_text,
+                                         deadline=state.get("deadline")):
+            chunks.append(chunk)
+            yield chunk
+    except CircuitOpenError:
+        # Raised before the first chunk, so the busy reply is the whole response
+        _busy_turn(state)
+        yield state["response"]
+        return
     
-    state["response"] = response_text
+    _finish_llm_turn(state, "".join(chunks))
+
+
+async def stream_chat(state: ChatState):
+    """Route a message and stream the response; the calculator route yields a single chunk."""
+    router_node(state)
     
-    return state
+    if route_decision(state) == "calculator":
+        calculator_node(state)
+        yield state["response"]
+        return
+    
+    async for chunk in llm_node_stream(state):
+        yield chunk
+
+
+def route_decision(state: ChatState) -> str:
+    """Pick the node after the router."""
+    if state["route"] == "calculator":
+        return "calculator"
+    else:
+        return "llm"
+
+
+def _inline_node(func):
+    """Wrap a CPU-only node so ainvoke runs it inline instead of in a worker thread."""
+    async def afunc(state):
+        return func(state)
+    return RunnableLambda(func, afunc=afunc)
 
 
 def build_graph():
@@ -114,20 +193,13 @@ def build_graph():
     graph = StateGraph(ChatState)
     
     # Add nodes
-    graph.add_node("router", router_node)
-    graph.add_node("calculator", calculator_node)
+    graph.add_node("router", _inline_node(router_node))
+    graph.add_node("calculator", _inline_node(calculator_node))
     graph.add_node("llm", llm_node)
     
     # Set start node
     graph.set_entry_point("router")
     
-    # Conditional routing based on router decision
-    def route_decision(state):
-        if state["route"] == "calculator":
-            return "calculator"
-        else:
-            return "llm"
-    
     # Add conditional edges
     graph.add_conditional_edges(
         "router",
@@ -149,13 +221,38 @@ def build_graph():
     return app
 
 
+class DirectDispatcher:
+    """Run router -> calculator | llm as direct calls, without StateGraph machinery.
+    
+    Same nodes and routing as build_graph(), but the state is copied once and
+    then updated in place: no per-step state copies, edge resolution or
+    channel updates. Exposes ainvoke() like the compiled graph.
+    """
+    
+    async def ainvoke(self, state: ChatState) -> ChatState:
+        state = ChatState(**state)
+        router_node(state)
+        if route_decision(state) == "calculator":
+            return calculator_node(state)
+        return await llm_node(state)
+
+
+def build_dispatcher():
+    """Build the direct-dispatch equivalent of build_graph()."""
+    logger.info("Using direct node dispatch")
+    return DirectDispatcher()
+
+
 # Global graph instance
 _graph_instance = None
+_graph_lock = threading.Lock()
 
 
 def get_graph():
-    """Get or create the compiled graph."""
+    """Get or create the direct dispatcher (or compiled graph, with GRAPH_DISPATCH=langgraph)."""
     global _graph_instance
     if _graph_instance is None:
-        _graph_instance = build_graph()
+        with _graph_lock:
+            if _graph_instance is None:
+                _graph_instance = build_graph() if GRAPH_DISPATCH == "langgraph" else build_dispatcher()
     return _graph_instance
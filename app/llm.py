@@ -1,8 +1,17 @@
+import asyncio
 import os
+import threading
+import time
 from pathlib import Path
 from dotenv import load_dotenv
+import google.ai.generativelanguage as glm
 import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.generativeai.types import generation_types
 from langchain.prompts import PromptTemplate
+from app.cache import cache_key, response_cache, fuzzy_cache, single_flight
+from app.resilience import LLM_REQUEST_TIMEOUT_SECONDS, CircuitOpenError, breaker, upstream, with_deadline, stream_with_deadline
+from app.tracing import span, traced
 from app.logging_utils import setup_logger
 
 # Load environment variables from .env file in project root
@@ -34,90 +43,340 @@ User: {input}
 Assistant:"""
 }
 
+# Prompt used to fold older conversation turns into a running summary
+SUMMARY_PROMPT = """Update the running summary of a conversation with the new turns below.
+Keep names, facts and open questions the assistant may need later. Drop small talk.
+Answer with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+# Reply while the LLM circuit breaker is open and nothing is cached for the prompt
+BUSY_RESPONSE = "The assistant is busy right now. Please try again in a moment."
+
 # Default prompt variant
 DEFAULT_PROMPT_KEY = "professional"
 
+# Gemini model used for every request
+MODEL_NAME = "gemini-2.5-flash"
+
+# Maximum number of Gemini calls in flight per process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+
+# Process-wide client registry. genai.configure() drops the cached gRPC clients,
+# so it must run once per process for the upstream connection to stay warm.
+_llm_lock = threading.Lock()
+_llm_instance = None
+_prompt_templates = {}
+_chains = {}
+_llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+
+class LLMResponse:
+    """Response object with a content field so it works everywhere."""
+    
+    __slots__ = ("content",)
+    
+    def __init__(self, text):
+        self.content = text
+
 
 class GeminiChainWrapper:
     """Wrapper to make Gemini work like a LangChain chain."""
     
-    def __init__(self, api_key):
+    def __init__(self, api_key, model_name=MODEL_NAME):
         self.api_key = api_key
+        self.model_name = model_name
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model = genai.GenerativeModel(model_name)
     
+    def _request(self, prompt_text):
+        return glm.GenerateContentRequest(
+            model=self.model.model_name,
+            contents=[{"role": "user", "parts": [{"text": prompt_text}]}]
+        )
+    
+    @traced()
     def invoke(self, inputs):
         """Invoke the model with the given input."""
         prompt_text = inputs.get("input", "")
-        logger.info("-"*60)
-        logger.info("GEMINI API CALL")
-        logger.info(f"Prompt Length: {len(prompt_text)} characters")
-        logger.info(f"Prompt Preview: {prompt_text[:150]}..." if len(prompt_text) > 150 else f"Prompt: {prompt_text}")
+        _log_prompt(prompt_text)
+        
+        # GenerativeModel.generate_content takes no timeout; call the pooled client directly
+        response = genai_client.get_default_generative_client().generate_content(
+            self._request(prompt_text), timeout=LLM_REQUEST_TIMEOUT_SECONDS
+        )
+        text = generation_types.GenerateContentResponse.from_response(response).text
         
-        response = self.model.generate_content(prompt_text)
+        _log_response(text)
+        return LLMResponse(text)
+    
+    @traced()
+    async def ainvoke(self, inputs):
+        """Invoke the model without blocking the event loop."""
+        prompt_text = inputs.get("input", "")
+        _log_prompt(prompt_text)
         
-        logger.info(f"Response Length: {len(response.text)} characters")
-        logger.info(f"Response Preview: {response.text[:200]}..." if len(response.text) > 200 else f"Response: {response.text}")
-        logger.info("Gemini API call completed successfully")
-        logger.info("-"*60)
+        async with _llm_semaphore:
+            response = await self.model.generate_content_async(prompt_text)
         
-        # Return an object that has a content field so it works everywhere.
-        class Response:
-            def __init__(self, text):
-                self.content = text
-        return Response(response.text)
+        _log_response(response.text)
+        return LLMResponse(response.text)
+    
+    @traced()
+    async def astream(self, inputs):
+        """Yield response text chunks as soon as Gemini sends them."""
+        prompt_text = inputs.get("input", "")
+        _log_prompt(prompt_text)
+        
+        # Read the raw stream: the SDK's response iterator holds each chunk back
+        # until the next one arrives, which delays the first byte.
+        chunks = []
+        async with _llm_semaphore:
+            async_client = genai_client.get_default_generative_async_client()
+            stream = await async_client.stream_generate_content(self._request(prompt_text))
+            async for chunk in stream:
+                if not chunk.candidates:
+                    continue
+                text = "".join(part.text for part in chunk.candidates[0].content.parts)
+                if text:
+                    chunks.append(text)
+                    yield text
+        
+        _log_response("".join(chunks))
+    
+    async def aping(self, timeout=10):
+        """Open, or keep open, the pooled async connection with a CountTokens call (no generation)."""
+        async_client = genai_client.get_default_generative_async_client()
+        request = glm.CountTokensRequest(
+            model=self.model.model_name,
+            contents=[{"role": "user", "parts": [{"text": "ping"}]}]
+        )
+        await async_client.count_tokens(request, timeout=timeout)
+
+
+def _log_prompt(prompt_text):
+    logger.info("-"*60)
+    logger.info("GEMINI API CALL")
+    logger.info(f"Prompt Length: {len(prompt_text)} characters")
+    logger.info(f"Prompt Preview: {prompt_text[:150]}..." if len(prompt_text) > 150 else f"Prompt: {prompt_text}")
+
+
+def _log_response(response_text):
+    logger.info(f"Response Length: {len(response_text)} characters")
+    logger.info(f"Response Preview: {response_text[:200]}..." if len(response_text) > 200 else f"Response: {response_text}")
+    logger.info("Gemini API call completed successfully")
+    logger.info("-"*60)
+
+
+class PromptLLMChain:
+    """Format a prompt template and invoke the LLM with it."""
+    
+    def __init__(self, prompt_template, llm_model, variant=DEFAULT_PROMPT_KEY):
+        self.prompt_template = prompt_template
+        self.llm_model = llm_model
+        self.variant = variant
+    
+    def _cache_lookup(self, formatted_prompt, use_cache, fuzzy_text):
+        """Return (cache key, fuzzy signature, cached response or None).
+        
+        fuzzy_text is the user message of a first turn; it is also matched
+        against near-duplicate prompts of the same variant. Its signature is
+        returned so that _cache_store() does not compute it again.
+        """
+        if not use_cache:
+            return None, None, None
+        key = self._flight_key(formatted_prompt)
+        signature = None
+        cached = response_cache.get(key)
+        if cached is None and fuzzy_text is not None:
+            signature = fuzzy_cache.signature(fuzzy_text)
+            cached = fuzzy_cache.get(self.variant, signature)
+        if cached is not None:
+            logger.info(f"LLM cache hit for variant '{self.variant}'")
+        return key, signature, cached
+    
+    def _flight_key(self, formatted_prompt):
+        """Key shared by the response cache and single-flight coalescing."""
+        model_name = getattr(self.llm_model, "model_name", MODEL_NAME)
+        return cache_key(model_name, self.variant, formatted_prompt)
+    
+    def _degraded_lookup(self, formatted_prompt, fuzzy_text, signature):
+        """Answer from the caches, stale entries included, while the circuit is open.
+        
+        Raises CircuitOpenError when nothing is cached for the prompt.
+        """
+        cached = response_cache.get_stale(self._flight_key(formatted_prompt))
+        if cached is None and fuzzy_text is not None:
+            if signature is None:
+                signature = fuzzy_cache.signature(fuzzy_text)
+            cached = fuzzy_cache.get(self.variant, signature)
+        if cached is None:
+            raise CircuitOpenError("LLM circuit breaker is open")
+        logger.warning(f"LLM circuit open; serving cached response for variant '{self.variant}'")
+        return cached
+    
+    def _cache_store(self, key, signature, response_text):
+        if key is None:
+            return
+        response_cache.set(key, response_text)
+        fuzzy_cache.set(self.variant, signature, response_text)
+    
+    def invoke(self, inputs, use_cache=True, fuzzy_text=None):
+        """Format prompt and invoke LLM."""
+        with span("format_prompt"):
+            formatted_prompt = self.prompt_template.format(**inputs)
+        key, signature, cached = self._cache_lookup(formatted_prompt, use_cache, fuzzy_text)
+        if cached is not None:
+            return LLMResponse(cached)
+        
+        response = self.llm_model.invoke({"input": formatted_prompt})
+        self._cache_store(key, signature, response.content)
+        return response
+    
+    async def ainvoke(self, inputs, use_cache=True, fuzzy_text=None, deadline=None):
+        """Format prompt and invoke LLM asynchronously, within the request deadline."""
+        with span("format_prompt"):
+            formatted_prompt = self.prompt_template.format(**inputs)
+        key, signature, cached = self._cache_lookup(formatted_prompt, use_cache, fuzzy_text)
+        if cached is not None:
+            return LLMResponse(cached)
+        
+        # Identical prompts already in flight share one upstream call; each
+        # caller still gives up at its own deadline. Callers that opted out of
+        # caching (key is None) always make their own call.
+        def call():
+            return breaker.call(
+                lambda: upstream.call(lambda: self.llm_model.ainvoke({"input": formatted_prompt}), deadline)
+            )
+        try:
+            if key is None or not single_flight.enabled:
+                # upstream.call enforces the deadline itself, so the breaker
+                # records the timeout; an outer timeout would cancel it unrecorded
+                response = await call()
+            else:
+                response = await with_deadline(single_flight.run(key, call), deadline)
+        except CircuitOpenError:
+            return LLMResponse(self._degraded_lookup(formatted_prompt, fuzzy_text, signature))
+        self._cache_store(key, signature, response.content)
+        return response
+    
+    async def astream(self, inputs, use_cache=True, fuzzy_text=None, deadline=None):
+        """Format prompt and stream LLM response chunks."""
+        with span("format_prompt"):
+            formatted_prompt = self.prompt_template.format(**inputs)
+        key, signature, cached = self._cache_lookup(formatted_prompt, use_cache, fuzzy_text)
+        if cached is not None:
+            yield cached
+            return
+        
+        # Join an identical non-streaming call already in flight; streams never
+        # lead a shared call, so their first chunk is not delayed.
+        shared = single_flight.in_flight(key) if key is not None else None
+        if shared is not None:
+            response = await with_deadline(asyncio.shield(shared), deadline)
+            self._cache_store(key, signature, response.content)
+            yield response.content
+            return
+        
+        if not breaker.allow():
+            yield self._degraded_lookup(formatted_prompt, fuzzy_text, signature)
+            return
+        
+        chunks = []
+        start = time.monotonic()
+        try:
+            async for chunk in stream_with_deadline(self.llm_model.astream({"input": formatted_prompt}), deadline):
+                chunks.append(chunk)
+                yield chunk
+        except Exception:
+            breaker.record(True)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record(False, time.monotonic() - start)
+        self._cache_store(key, signature, "".join(chunks))
 
 
 def get_llm():
-    """Initialize Google Gemini model."""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key or api_key == "YOUR_GEMINI_API_KEY_HERE":
-        raise ValueError("GEMINI_API_KEY environment variable is not set or still has placeholder value. Please configure it in .env file.")
+    """Return the process-wide Google Gemini client, creating it on first use."""
+    global _llm_instance
+    if _llm_instance is not None:
+        return _llm_instance
+    
+    with _llm_lock:
+        if _llm_instance is None:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key or api_key == "YOUR_GEMINI_API_KEY_HERE":
+                raise ValueError("GEMINI_API_KEY environment variable is not set or still has placeholder value. Please configure it in .env file.")
+            
+            _llm_instance = GeminiChainWrapper(api_key)
+            logger.info(f"Gemini client initialized: {MODEL_NAME}")
     
-    return GeminiChainWrapper(api_key)
+    return _llm_instance
 
 
+@traced()
 def get_prompt_template(variant=DEFAULT_PROMPT_KEY):
     """Get a prompt template by variant name."""
-    logger.info(f"Getting prompt template for variant: '{variant}'")
-    prompt_text = PROMPT_VARIANTS.get(variant, PROMPT_VARIANTS[DEFAULT_PROMPT_KEY])
-    
     if variant not in PROMPT_VARIANTS:
         logger.warning(f"Variant '{variant}' not found, using default '{DEFAULT_PROMPT_KEY}'")
-    else:
+        variant = DEFAULT_PROMPT_KEY
+    
+    template = _prompt_templates.get(variant)
+    if template is None:
+        template = PromptTemplate(
+            input_variables=["input"],
+            template=PROMPT_VARIANTS[variant]
+        )
+        _prompt_templates[variant] = template
         logger.info(f"Prompt template loaded successfully for variant '{variant}'")
     
-    return PromptTemplate(
-        input_variables=["input"],
-        template=prompt_text
+    return template
+
+
+@traced()
+def get_chain(variant=DEFAULT_PROMPT_KEY):
+    """Get the pre-built chain for a prompt variant."""
+    if not _chains:
+        llm = get_llm()
+        with _llm_lock:
+            if not _chains:
+                _chains.update({
+                    name: PromptLLMChain(get_prompt_template(name), llm, name)
+                    for name in PROMPT_VARIANTS
+                })
+                logger.info(f"Built LLM chains for variants: {list(_chains)}")
+    
+    if variant not in _chains:
+        logger.warning(f"Variant '{variant}' not found, using default '{DEFAULT_PROMPT_KEY}'")
+        variant = DEFAULT_PROMPT_KEY
+    return _chains[variant]
+
+
+async def asummarize(summary, turns, max_words=150):
+    """Fold conversation turns into a running summary."""
+    prompt_text = SUMMARY_PROMPT.format(
+        max_words=max_words,
+        summary=summary or "(none)",
+        turns=turns
     )
+    llm = get_llm()
+    response = await breaker.call(lambda: upstream.call(lambda: llm.ainvoke({"input": prompt_text})))
+    return response.content.strip()
+
+
+def chains_ready():
+    """True once the prompt templates and per-variant chains are built."""
+    return bool(_chains)
 
 
 def create_llm_chain():
     """Create a simple LLM chain for text generation."""
-    logger.info("\n" + "="*60)
-    logger.info("CREATING LLM CHAIN")
-    logger.info("="*60)
-    
-    llm = get_llm()
-    prompt = get_prompt_template()
-    
-    # Create a wrapper chain that applies prompt then calls llm
-    class PromptLLMChain:
-        def __init__(self, prompt_template, llm_model):
-            self.prompt_template = prompt_template
-            self.llm_model = llm_model
-            logger.info("PromptLLMChain wrapper created")
-        
-        def invoke(self, inputs):
-            """Format prompt and invoke LLM."""
-            logger.info(f"\nFormatting prompt with inputs: {list(inputs.keys())}")
-            formatted_prompt = self.prompt_template.format(**inputs)
-            logger.info(f"Formatted prompt ready, invoking LLM...")
-            response = self.llm_model.invoke({"input": formatted_prompt})
-            logger.info("LLM invocation completed")
-            return response
-    
-    logger.info("LLM chain created successfully")
-    logger.info("="*60 + "\n")
-    return PromptLLMChain(prompt, llm)
+    return get_chain(DEFAULT_PROMPT_KEY)
@@ -1,9 +1,174 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, RotatingFileHandler
 
 LOG_DIR = "logs"
 
+# "file" writes each module to its own log synchronously; "queue" hands records
+# to a background listener that batches them into one JSON-lines file.
+LOG_MODE = os.getenv("LOG_MODE", "file")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")  # per module, e.g. "app.monitoring=WARNING,app.llm=ERROR"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")  # share of INFO/DEBUG records kept, e.g. "app.graph=0.1"
+LOG_JSON_FILE = os.getenv("LOG_JSON_FILE", f"{LOG_DIR}/app.jsonl")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "512"))
+
+
+def _parse_module_settings(value):
+    """Parse "module=value,module=value" into a dict."""
+    settings = {}
+    for item in value.split(","):
+        if "=" in item:
+            module, setting = item.split("=", 1)
+            settings[module.strip()] = setting.strip()
+    return settings
+
+
+_module_levels = _parse_module_settings(LOG_LEVELS)
+_module_sampling = {module: float(rate) for module, rate in _parse_module_settings(LOG_SAMPLING).items()}
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a random share of records below WARNING; warnings and errors always pass."""
+    
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """Format a record as one JSON object per line."""
+    
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Enqueue records untouched; formatting happens on the listener thread."""
+    
+    def __init__(self, log_queue, max_size=LOG_QUEUE_SIZE):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+    
+    def handle(self, record):
+        # SimpleQueue.put is atomic, so the handler lock is not needed.
+        if self.filter(record):
+            self.enqueue(record)
+        return record
+    
+    def prepare(self, record):
+        # The queue is in-process, so the record needs no pickling-safe copy.
+        return record
+    
+    def enqueue(self, record):
+        # When the listener falls behind, shed INFO/DEBUG but never warnings or errors.
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put(record)
+
+
+class _BatchingListener:
+    """Background thread that drains the log queue and writes records in batches."""
+    
+    def __init__(self, log_queue, handler, batch_size=LOG_BATCH_SIZE):
+        self.queue = log_queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self._thread = threading.Thread(target=self._run, name="log-listener", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            batch = [record]
+            while record is not None and len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(record)
+            
+            self._write(batch)
+            if batch[-1] is None:
+                break
+    
+    def _write(self, batch):
+        handler = self.handler
+        handler.acquire()
+        try:
+            for record in batch:
+                if record is None:
+                    continue
+                try:
+                    if handler.shouldRollover(record):
+                        handler.doRollover()
+                    handler.stream.write(handler.format(record) + "\n")
+                except Exception:
+                    handler.handleError(record)
+            handler.flush()
+        finally:
+            handler.release()
+    
+    def stop(self):
+        """Write everything still queued, then stop the thread."""
+        self.queue.put(None)
+        self._thread.join()
+        self.handler.close()
+
+
+_queue_handler = None
+_listener = None
+_queue_lock = threading.Lock()
+
+
+def _get_queue_handler():
+    """Create the shared queue handler and start its listener on first use."""
+    global _queue_handler, _listener
+    with _queue_lock:
+        if _queue_handler is None:
+            # JSON lines carry no caller or process details; skipping their
+            # collection is the main per-record saving (see the logging HOWTO).
+            logging._srcfile = None
+            logging.logThreads = False
+            logging.logProcesses = False
+            logging.logMultiprocessing = False
+            
+            log_queue = queue.SimpleQueue()
+            file_handler = RotatingFileHandler(
+                LOG_JSON_FILE,
+                maxBytes=5 * 1024 * 1024,
+                backupCount=3
+            )
+            file_handler.setFormatter(JSONFormatter())
+            _listener = _BatchingListener(log_queue, file_handler)
+            _queue_handler = _NonBlockingQueueHandler(log_queue)
+            atexit.register(_listener.stop)
+        return _queue_handler
+
+
+def get_dropped_log_count():
+    """Records dropped because the log queue was full (queue mode only)."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
 
 def setup_logger(name, log_file=None):
     """Create a logger that writes to a file in the logs/ directory."""
@@ -13,18 +178,24 @@ def setup_logger(name, log_file=None):
     os.makedirs(LOG_DIR, exist_ok=True)
     
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(_module_levels.get(name, LOG_LEVEL).upper())
     
     if not logger.handlers:
-        handler = RotatingFileHandler(
-            log_file,
-            maxBytes=5 * 1024 * 1024,
-            backupCount=3
-        )
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
-        handler.setFormatter(formatter)
+        if LOG_MODE == "queue":
+            handler = _get_queue_handler()
+        else:
+            handler = RotatingFileHandler(
+                log_file,
+                maxBytes=5 * 1024 * 1024,
+                backupCount=3
+            )
+            formatter = logging.Formatter(
+                "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+            )
+            handler.setFormatter(formatter)
         logger.addHandler(handler)
+        
+        if name in _module_sampling:
+            logger.addFilter(SamplingFilter(_module_sampling[name]))
     
     return logger
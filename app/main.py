@@ -1,22 +1,48 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse
+import asyncio
+import json
+import os
+import time
+from typing import TYPE_CHECKING, List
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from pathlib import Path
 from dotenv import load_dotenv
-from app.graph import get_graph, ChatState
+from app.admission import AdmissionMiddleware, admission, session_locks
+from app.calculator import batch_result_json, evaluate_batch
+from app.memory import summarize_if_needed, close_backend
 from app.monitoring import RequestTimer, record_request
+from app.readiness import readiness
+from app.resilience import deadline_after
 from app.logging_utils import setup_logger
 from fastapi.middleware.cors import CORSMiddleware
 
+if TYPE_CHECKING:
+    from app.graph import ChatState
+
 # Load environment variables from .env file
 env_path = Path(__file__).parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 logger = setup_logger(__name__)
 
+# /chat/batch: items (and so Gemini calls) in flight per batch, and batch size limit
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+# /calculate/batch: expressions per request
+CALC_BATCH_MAX_ITEMS = int(os.getenv("CALC_BATCH_MAX_ITEMS", "100000"))
+
+# Accept connections before the graph is compiled; it warms up in the background
+FAST_START = os.getenv("FAST_START", "false").lower() == "true"
+
 app = FastAPI(title="LLM Chatbot Service", version="1.0")
 
+# Shed load with 429 + Retry-After once the admission queue is full
+app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -36,6 +62,7 @@ class ChatRequest(BaseModel):
     session_id: str
     message: str
     prompt_variant: str = "professional"  # Default to professional
+    use_cache: bool = True  # Set to False to always call the LLM
 
 
 class ChatResponse(BaseModel):
@@ -43,40 +70,105 @@ class ChatResponse(BaseModel):
     session_id: str
 
 
+class CalculateBatchRequest(BaseModel):
+    expressions: List[str]
+
+
+def _initial_state(request: ChatRequest) -> "ChatState":
+    """Build the graph input for a chat request."""
+    return {
+        "session_id": request.session_id,
+        "message": request.message,
+        "response": "",
+        "route": "",
+        "prompt_variant": request.prompt_variant,
+        "use_cache": request.use_cache,
+        "deadline": deadline_after()
+    }
+
+
+def _load_graph():
+    """Import and compile the graph and create the LLM client; slow on a cold start."""
+    start = time.perf_counter()
+    from app import graph
+    graph.get_graph()
+    readiness.graph = True
+    logger.info(f"Graph initialized in {time.perf_counter() - start:.2f}s")
+    try:
+        from app.llm import get_chain, chains_ready
+        get_chain()
+        readiness.prompts = chains_ready()
+    except Exception as e:
+        logger.warning(f"LLM client not warmed up: {e}")
+    return graph
+
+
+# Future of the graph module while it loads in a worker thread
+_graph_loading = None
+
+
+def _graph_loaded(future):
+    global _graph_loading
+    if future.cancelled() or future.exception() is not None:
+        logger.error(f"Graph warm-up failed: {None if future.cancelled() else future.exception()}")
+        _graph_loading = None  # the next request tries again
+
+
+def _start_graph_loading():
+    global _graph_loading
+    _graph_loading = asyncio.get_running_loop().run_in_executor(None, _load_graph)
+    _graph_loading.add_done_callback(_graph_loaded)
+
+
+async def _graph_module():
+    """Return app.graph, loading it off the event loop the first time."""
+    if _graph_loading is None:
+        _start_graph_loading()
+    return await asyncio.shield(_graph_loading)
+
+
 @app.on_event("startup")
-def startup_event():
-    """Initialize graph on startup."""
+async def startup_event():
+    """Initialize graph on startup, or start warming it up in FAST_START mode."""
+    global _graph_loading
     logger.info("Server starting up")
-    get_graph()
-    logger.info("Graph initialized")
+    if FAST_START:
+        _start_graph_loading()
+        logger.info("Fast start: warming up the graph in the background")
+    else:
+        _graph_loading = asyncio.get_running_loop().create_future()
+        _graph_loading.set_result(_load_graph())
+    # Open the upstream connection and keep it warm; /ready reports the result
+    readiness.start(_graph_module)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the keep-alive and flush pending session writes on shutdown."""
+    await readiness.stop()
+    close_backend()
+    logger.info("Server shut down")
 
 
 @app.post("/chat")
-def chat(request: ChatRequest) -> ChatResponse:   
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks) -> ChatResponse:
     with RequestTimer() as timer:
         session_id = request.session_id
         message = request.message
         prompt_variant = request.prompt_variant
         route_taken = "unknown"
         response_text = ""
+        error = None
         
         try:
             logger.info(f"[{session_id}] === NEW REQUEST === Message: '{message}' | Variant: {prompt_variant}")
             
-            # Get the compiled graph
-            graph = get_graph()
+            # Get the graph runner (direct dispatcher or compiled graph)
+            graph = (await _graph_module()).get_graph()
             
-            # Prepare initial state
-            initial_state: ChatState = {
-                "session_id": session_id,
-                "message": message,
-                "response": "",
-                "route": "",
-                "prompt_variant": prompt_variant
-            }
-            
-            # Run the graph
-            result = graph.invoke(initial_state)
+            # Run the graph without holding a worker thread; turns of one session run in order
+            async with session_locks.hold(session_id):
+                result = await graph.ainvoke(_initial_state(request))
             
             response_text = result.get("response", "No response generated")
             route_taken = result.get("route", "unknown")
@@ -86,34 +178,233 @@ def chat(request: ChatRequest) -> ChatResponse:
         except Exception as e:
             logger.error(f"Error processing request: {e}", exc_info=True)
             route_taken = "ERROR"
-            raise HTTPException(status_code=500, detail=str(e))
+            error = e
     
     # Record metrics after timer context exits
     record_request(
         latency_seconds=timer.elapsed,
         session_id=session_id,
         route_taken=route_taken.upper(),
-        message_preview=message[:100] if len(message) > 100 else message
+        message_preview=message[:100] if len(message) > 100 else message,
+        prompt_variant=prompt_variant
     )
     
+    if error is not None:
+        # 504 when the LLM did not answer within the request deadline
+        raise HTTPException(status_code=504 if isinstance(error, TimeoutError) else 500, detail=str(error))
+    
+    # Fold older turns into the session summary after the response is sent
+    background_tasks.add_task(summarize_if_needed, session_id)
+    
     return ChatResponse(
         response=response_text,
         session_id=session_id
     )
 
 
+def _sse_event(data, event=None):
+    """Format one Server-Sent Events frame."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream the response as Server-Sent Events."""
+    session_id = request.session_id
+    message = request.message
+    initial_state = _initial_state(request)
+    
+    async def event_stream():
+        route_taken = "unknown"
+        with RequestTimer("stream") as timer:
+            logger.info(f"[{session_id}] === NEW STREAM REQUEST === Message: '{message}' | Variant: {request.prompt_variant}")
+            first_chunk_at = None
+            try:
+                stream_chat = (await _graph_module()).stream_chat
+                async with session_locks.hold(session_id):
+                    async for chunk in stream_chat(initial_state):
+                        if first_chunk_at is None:
+                            first_chunk_at = time.time()
+                            logger.info(f"[{session_id}] Time to first chunk: {first_chunk_at - timer.start_time:.3f}s")
+                        yield _sse_event({"chunk": chunk})
+                
+                route_taken = initial_state["route"] or "unknown"
+                yield _sse_event({"route": route_taken, "session_id": session_id}, event="done")
+                logger.info(f"[{session_id}] === STREAM COMPLETE === Route: {route_taken.upper()}")
+            except Exception as e:
+                logger.error(f"Error streaming request: {e}", exc_info=True)
+                route_taken = "ERROR"
+                yield _sse_event({"detail": str(e)}, event="error")
+        
+        record_request(
+            latency_seconds=timer.elapsed,
+            session_id=session_id,
+            route_taken=route_taken.upper(),
+            message_preview=message[:100] if len(message) > 100 else message,
+            prompt_variant=request.prompt_variant
+        )
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(summarize_if_needed, session_id)
+    )
+
+
+async def _run_batch_item(index, request: ChatRequest):
+    """Run one batch item through the graph and return its result line."""
+    session_id = request.session_id
+    message = request.message
+    route_taken = "unknown"
+    with RequestTimer("batch") as timer:
+        try:
+            graph = (await _graph_module()).get_graph()
+            async with session_locks.hold(session_id):
+                result = await graph.ainvoke(_initial_state(request))
+            route_taken = result.get("route", "unknown")
+            item = {
+                "index": index,
+                "session_id": session_id,
+                "status": "ok",
+                "route": route_taken,
+                "response": result.get("response", "No response generated")
+            }
+        except Exception as e:
+            logger.error(f"[{session_id}] Batch item {index} failed: {e}", exc_info=True)
+            route_taken = "ERROR"
+            item = {"index": index, "session_id": session_id, "status": "error", "detail": str(e)}
+    
+    record_request(
+        latency_seconds=timer.elapsed,
+        session_id=session_id,
+        route_taken=route_taken.upper(),
+        message_preview=message[:100] if len(message) > 100 else message,
+        prompt_variant=request.prompt_variant
+    )
+    return item
+
+
+async def _run_batch_session(items, results, semaphore):
+    """Run one session's batch items in order, publishing each result as it completes."""
+    for index, request in items:
+        async with semaphore:
+            results[index].set_result(await _run_batch_item(index, request))
+
+
+async def _summarize_sessions(session_ids):
+    for session_id in session_ids:
+        await summarize_if_needed(session_id)
+
+
+@app.post("/chat/batch")
+async def chat_batch(requests: List[ChatRequest]):
+    """Run many chat requests and stream one NDJSON result line per item, in input order.
+    
+    Different sessions run concurrently; turns of the same session run in
+    the order given so each sees the previous turn in its history.
+    """
+    if len(requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(requests)} items (limit {BATCH_MAX_ITEMS})")
+    
+    by_session = {}
+    for index, request in enumerate(requests):
+        by_session.setdefault(request.session_id, []).append((index, request))
+    logger.info(f"=== NEW BATCH === {len(requests)} items across {len(by_session)} sessions")
+    
+    async def result_stream():
+        loop = asyncio.get_running_loop()
+        results = [loop.create_future() for _ in requests]
+        semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+        tasks = [asyncio.create_task(_run_batch_session(items, results, semaphore)) for items in by_session.values()]
+        try:
+            for result in results:
+                yield json.dumps(await result) + "\n"
+            logger.info(f"=== BATCH COMPLETE === {len(requests)} items")
+        finally:
+            # Stop outstanding work if the client disconnects early
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(_summarize_sessions, list(by_session))
+    )
+
+
+@app.post("/calculate/batch")
+def calculate_batch(request: CalculateBatchRequest):
+    """Evaluate many arithmetic expressions without the chat graph; results are in input order.
+    
+    Each result is the calculator's value for that expression, or null
+    where it cannot be calculated.
+    """
+    expressions = request.expressions
+    if len(expressions) > CALC_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(expressions)} expressions (limit {CALC_BATCH_MAX_ITEMS})")
+    
+    with RequestTimer() as timer:
+        results, stats = evaluate_batch(expressions)
+    record_request(
+        latency_seconds=timer.elapsed,
+        route_taken="CALCULATOR_BATCH",
+        message_preview=f"{len(expressions)} expressions"
+    )
+    
+    return JSONResponse({"results": [batch_result_json(value) for value in results], **stats})
+
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+def ready_check():
+    """Ready once the graph, prompt chains and a warm upstream connection are in place."""
+    ready, checks = readiness.status()
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", "checks": checks},
+        status_code=200 if ready else 503
+    )
+
+
 @app.get("/metrics")
 def get_metrics_endpoint():
     from app.monitoring import get_metrics
+    from app.cache import response_cache, fuzzy_cache, single_flight
+    from app.resilience import upstream, breaker
     metrics = get_metrics()
+    metrics["llm_cache"] = response_cache.stats()
+    metrics["llm_fuzzy_cache"] = fuzzy_cache.stats()
+    metrics["llm_single_flight"] = single_flight.stats()
+    metrics["llm_upstream"] = upstream.stats()
+    metrics["llm_circuit_breaker"] = breaker.stats()
+    metrics["admission"] = admission.stats()
+    metrics["admission"]["locked_sessions"] = len(session_locks)
     return metrics
 
 
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+def get_prometheus_metrics_endpoint():
+    from app.monitoring import get_prometheus_metrics
+    return PlainTextResponse(get_prometheus_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/sessions")
+def get_session_metrics_endpoint():
+    from app.memory import get_session_metrics
+    return get_session_metrics()
+
+
+@app.get("/debug/traces")
+def get_traces_endpoint(limit: int = 20):
+    from app.tracing import get_traces
+    return get_traces(limit)
+
+
 @app.get("/test_ui", response_class=HTMLResponse)
 def test_ui():
     html_file = Path(__file__).parent / "static" / "index.html"
@@ -1,40 +1,524 @@
-from langchain.memory import ConversationBufferMemory
+import asyncio
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
 from app.logging_utils import setup_logger
+from app.storage import create_backend
+from app.tracing import traced
 
 logger = setup_logger(__name__)
 
-# In-memory session storage: session_id -> ConversationBufferMemory
-sessions = {}
+# Session store limits
+SESSION_SHARDS = int(os.getenv("SESSION_SHARDS", "16"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
 
+# "buffer" keeps the full conversation as one compact transcript; "window" keeps
+# the newest turns verbatim within a token budget and folds older turns into a
+# running summary; "langchain" keeps the full conversation in a LangChain
+# ConversationBufferMemory (one message object per message).
+MEMORY_MODE = os.getenv("MEMORY_MODE", "buffer")
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1000"))
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "4"))
+# Older turns are folded into the summary once this many have piled up, in one LLM call
+MEMORY_SUMMARY_BATCH_TURNS = int(os.getenv("MEMORY_SUMMARY_BATCH_TURNS", "4"))
 
+# Approximate heap cost of an empty ConversationBufferMemory and of one message object
+_MEMORY_OVERHEAD_BYTES = 1300
+_MESSAGE_OVERHEAD_BYTES = 700
+
+# Approximate heap cost of an empty CompactHistory and the framing of one turn
+_COMPACT_OVERHEAD_BYTES = 200
+_COMPACT_TURN_OVERHEAD_BYTES = len("\nHuman: \nAI: ") + 8
+
+
+class _SessionEntry:
+    __slots__ = ("memory", "last_access", "size_bytes")
+    
+    def __init__(self, memory, now, size_bytes):
+        self.memory = memory
+        self.last_access = now
+        self.size_bytes = size_bytes
+
+
+class _Shard:
+    __slots__ = ("lock", "entries", "size_bytes", "ttl_evictions", "lru_evictions")
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # least recently used first
+        self.size_bytes = 0
+        self.ttl_evictions = 0
+        self.lru_evictions = 0
+
+
+class SessionStore:
+    """Sharded session_id -> memory store with idle-TTL and LRU eviction.
+    
+    Each shard has its own lock, so requests for different sessions rarely
+    contend. Session count and byte limits are split evenly across shards.
+    """
+    
+    def __init__(self, shards=SESSION_SHARDS, ttl_seconds=SESSION_TTL_SECONDS,
+                 max_sessions=SESSION_MAX_COUNT, max_bytes=SESSION_MAX_BYTES, sizeof=None):
+        self.sizeof = sizeof or (lambda memory: 0)
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._shard_max_sessions = max(1, max_sessions // len(self._shards))
+        self._shard_max_bytes = max(1, max_bytes // len(self._shards))
+    
+    def _shard_for(self, session_id):
+        return self._shards[hash(session_id) % len(self._shards)]
+    
+    def _evict(self, shard, now):
+        """Drop expired sessions, then least recently used ones over the limits. Caller holds the lock."""
+        entries = shard.entries
+        while entries:
+            session_id, entry = next(iter(entries.items()))
+            if self.ttl_seconds > 0 and now - entry.last_access > self.ttl_seconds:
+                reason = "ttl"
+            elif len(entries) > self._shard_max_sessions or shard.size_bytes > self._shard_max_bytes:
+                reason = "lru"
+            else:
+                break
+            
+            entries.popitem(last=False)
+            shard.size_bytes -= entry.size_bytes
+            if reason == "ttl":
+                shard.ttl_evictions += 1
+            else:
+                shard.lru_evictions += 1
+            logger.info(f"Evicted session ({reason}): {session_id}")
+    
+    def get(self, session_id):
+        """Return the memory for a session, or None if it is not cached."""
+        shard = self._shard_for(session_id)
+        with shard.lock:
+            entry = shard.entries.get(session_id)
+            if entry is None:
+                return None
+            entry.last_access = time.monotonic()
+            shard.entries.move_to_end(session_id)
+            return entry.memory
+    
+    def get_or_create(self, session_id, factory):
+        """Return the memory for a session, creating it with factory() if missing."""
+        shard = self._shard_for(session_id)
+        now = time.monotonic()
+        with shard.lock:
+            entry = shard.entries.get(session_id)
+            if entry is None:
+                memory = factory()
+                entry = _SessionEntry(memory, now, self.sizeof(memory))
+                shard.entries[session_id] = entry
+                shard.size_bytes += entry.size_bytes
+                logger.info(f"Created memory for session: {session_id}")
+            else:
+                entry.last_access = now
+                shard.entries.move_to_end(session_id)
+            self._evict(shard, now)
+            return entry.memory
+    
+    def update(self, session_id, factory, func, added_bytes=0):
+        """Apply func(memory) under the shard lock and account for added_bytes.
+        
+        added_bytes may also be a function of func's result, for updates that
+        can turn out to change nothing. With factory None, a session that is
+        not cached is left alone and None is returned.
+        """
+        shard = self._shard_for(session_id)
+        now = time.monotonic()
+        with shard.lock:
+            entry = shard.entries.get(session_id)
+            if entry is None:
+                if factory is None:
+                    return None
+                memory = factory()
+                entry = _SessionEntry(memory, now, self.sizeof(memory))
+                shard.entries[session_id] = entry
+                shard.size_bytes += entry.size_bytes
+            else:
+                entry.last_access = now
+                shard.entries.move_to_end(session_id)
+            result = func(entry.memory)
+            if callable(added_bytes):
+                added_bytes = added_bytes(result)
+            entry.size_bytes += added_bytes
+            shard.size_bytes += added_bytes
+            self._evict(shard, now)
+            return result
+    
+    def replace(self, session_id, memory):
+        """Store a freshly loaded memory object for a session."""
+        shard = self._shard_for(session_id)
+        now = time.monotonic()
+        with shard.lock:
+            old = shard.entries.pop(session_id, None)
+            if old is not None:
+                shard.size_bytes -= old.size_bytes
+            entry = _SessionEntry(memory, now, self.sizeof(memory))
+            shard.entries[session_id] = entry
+            shard.size_bytes += entry.size_bytes
+            self._evict(shard, now)
+    
+    def delete(self, session_id):
+        """Remove a session. Returns True if it existed."""
+        shard = self._shard_for(session_id)
+        with shard.lock:
+            entry = shard.entries.pop(session_id, None)
+            if entry is None:
+                return False
+            shard.size_bytes -= entry.size_bytes
+            return True
+    
+    def __contains__(self, session_id):
+        shard = self._shard_for(session_id)
+        with shard.lock:
+            return session_id in shard.entries
+    
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+    
+    def stats(self, top=10):
+        """Summarize live sessions, estimated memory use and eviction counts."""
+        now = time.monotonic()
+        live_sessions = 0
+        total_bytes = 0
+        ttl_evictions = 0
+        lru_evictions = 0
+        sizes = []
+        for shard in self._shards:
+            with shard.lock:
+                self._evict(shard, now)
+                live_sessions += len(shard.entries)
+                total_bytes += shard.size_bytes
+                ttl_evictions += shard.ttl_evictions
+                lru_evictions += shard.lru_evictions
+                sizes.extend((entry.size_bytes, session_id) for session_id, entry in shard.entries.items())
+        
+        sizes.sort(reverse=True)
+        return {
+            "live_sessions": live_sessions,
+            "total_bytes": total_bytes,
+            "average_bytes_per_session": total_bytes / live_sessions if live_sessions else 0,
+            "largest_sessions": [{"session_id": session_id, "bytes": size} for size, session_id in sizes[:top]],
+            "evictions": {"ttl": ttl_evictions, "lru": lru_evictions},
+            "limits": {
+                "shards": len(self._shards),
+                "ttl_seconds": self.ttl_seconds,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes
+            }
+        }
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+class SummaryWindowMemory:
+    """Newest turns verbatim plus a running summary of older turns, within a token budget."""
+    
+    __slots__ = ("turns", "summary", "folded_turns", "summarizing")
+    
+    def __init__(self):
+        self.turns = []  # (user_input, ai_response), oldest first, not yet summarized
+        self.summary = ""
+        self.folded_turns = 0  # turns already folded into the summary
+        self.summarizing = False
+    
+    def save_context(self, inputs, outputs):
+        self.turns.append((inputs["input"], outputs["output"]))
+    
+    @property
+    def needs_summary(self):
+        return len(self.turns) >= MEMORY_RECENT_TURNS + max(1, MEMORY_SUMMARY_BATCH_TURNS) and not self.summarizing
+    
+    @property
+    def buffer(self):
+        """Render the summary and as many unsummarized turns as fit the token budget, newest first.
+        
+        The newest turn is always included; if it alone is over the budget it is cut short.
+        """
+        budget = MEMORY_TOKEN_BUDGET
+        parts = []
+        if self.summary:
+            # The summary may use at most half of the budget (about four characters per token).
+            summary = f"Summary of earlier conversation: {self.summary[:MEMORY_TOKEN_BUDGET * 2]}"
+            budget -= estimate_tokens(summary)
+            parts.append(summary)
+        
+        recent = []
+        for user_input, ai_response in reversed(self.turns):
+            turn = f"Human: {user_input}\nAI: {ai_response}"
+            cost = estimate_tokens(turn)
+            if cost > budget:
+                if not recent:
+                    recent.append(turn[:max(budget, 1) * 4] + " ...")
+                break
+            budget -= cost
+            recent.append(turn)
+        
+        parts.extend(reversed(recent))
+        return "\n".join(parts)
+
+
+class CompactHistory:
+    """The full conversation as one rendered transcript plus turn offsets.
+    
+    Each turn is formatted once, as "Human: ...\nAI: ...", and appended to the
+    transcript, so reading the history never re-renders earlier turns. Turn
+    boundaries are kept in a flat array of string offsets instead of one
+    message object per message.
+    """
+    
+    __slots__ = ("text", "_offsets")
+    
+    def __init__(self):
+        self.text = ""
+        self._offsets = array("I")  # per turn: start of "Human: ", start of the AI response
+    
+    def append(self, user_input, ai_response):
+        separator = "\n" if self.text else ""
+        start = len(self.text) + len(separator)
+        human = f"Human: {user_input}\nAI: "
+        self._offsets.append(start)
+        self._offsets.append(start + len(human))
+        # One assignment, so concurrent readers see either the old or the new transcript
+        self.text = f"{self.text}{separator}{human}{ai_response}"
+    
+    def extend(self, turns):
+        """Append many (user_input, ai_response) turns with a single join."""
+        parts = [self.text] if self.text else []
+        start = len(self.text) + 1 if self.text else 0
+        for user_input, ai_response in turns:
+            human = f"Human: {user_input}\nAI: "
+            self._offsets.append(start)
+            self._offsets.append(start + len(human))
+            parts.append(f"{human}{ai_response}")
+            start += len(parts[-1]) + 1
+        self.text = "\n".join(parts)
+    
+    def save_context(self, inputs, outputs):
+        self.append(inputs["input"], outputs["output"])
+    
+    def turns(self):
+        """Yield (user_input, ai_response) pairs, oldest first."""
+        text, offsets = self.text, self._offsets
+        for i in range(0, len(offsets), 2):
+            end = offsets[i + 2] - 1 if i + 2 < len(offsets) else len(text)
+            yield text[offsets[i] + len("Human: "):offsets[i + 1] - len("\nAI: ")], text[offsets[i + 1]:end]
+    
+    def __len__(self):
+        return len(self._offsets) // 2
+    
+    @property
+    def buffer(self):
+        return self.text
+    
+    def size_bytes(self):
+        return _COMPACT_OVERHEAD_BYTES + sys.getsizeof(self.text) + self._offsets.buffer_info()[1] * self._offsets.itemsize
+
+
+def _new_memory():
+    if MEMORY_MODE == "window":
+        return SummaryWindowMemory()
+    if MEMORY_MODE != "langchain":
+        return CompactHistory()
+    from langchain.memory import ConversationBufferMemory  # deferred: slow to import
+    return ConversationBufferMemory(
+        memory_key="chat_history",
+        return_messages=True
+    )
+
+
+def _turn_texts(memory):
+    if isinstance(memory, SummaryWindowMemory):
+        return [memory.summary] + [text for turn in memory.turns for text in turn]
+    return [message.content for message in memory.chat_memory.messages]
+
+
+def _memory_size(memory):
+    """Estimate the heap bytes held by a memory object and its messages."""
+    if isinstance(memory, CompactHistory):
+        return memory.size_bytes()
+    return _MEMORY_OVERHEAD_BYTES + sum(sys.getsizeof(text) + _MESSAGE_OVERHEAD_BYTES for text in _turn_texts(memory))
+
+
+def _turn_bytes(user_input, ai_response):
+    """Estimate the heap bytes one turn adds to a session's memory."""
+    if MEMORY_MODE not in ("window", "langchain"):
+        # Characters appended to the transcript (sys.getsizeof minus the str header)
+        return sys.getsizeof(user_input) + sys.getsizeof(ai_response) - 2 * sys.getsizeof("") + _COMPACT_TURN_OVERHEAD_BYTES
+    return sys.getsizeof(user_input) + sys.getsizeof(ai_response) + 2 * _MESSAGE_OVERHEAD_BYTES
+
+
+def _turn_count(memory):
+    """Total turns recorded for a session, including summarized ones."""
+    if isinstance(memory, CompactHistory):
+        return len(memory)
+    if isinstance(memory, SummaryWindowMemory):
+        return memory.folded_turns + len(memory.turns)
+    return len(memory.chat_memory.messages) // 2
+
+
+def _load_memory(session_id):
+    """Create a session's memory, replaying stored history from the backend."""
+    memory = _new_memory()
+    if not backend.persistent:
+        return memory
+    
+    if isinstance(memory, CompactHistory):
+        memory.extend(backend.load_turns(session_id))
+    elif isinstance(memory, SummaryWindowMemory):
+        memory.summary, memory.folded_turns = backend.load_summary(session_id)
+        memory.turns = [tuple(turn) for turn in backend.load_turns(session_id, after=memory.folded_turns)]
+    else:
+        for user_input, ai_response in backend.load_turns(session_id):
+            memory.chat_memory.add_user_message(user_input)
+            memory.chat_memory.add_ai_message(ai_response)
+    return memory
+
+
+# Storage backend for session history (see app.storage)
+backend = create_backend()
+
+# Hot in-process session cache: session_id -> memory object (see MEMORY_MODE)
+sessions = SessionStore(sizeof=_memory_size)
+
+
+def _is_current(session_id, memory):
+    """True if cached memory is known to hold every stored turn, without reading storage."""
+    return (not backend.persistent or backend.has_pending(session_id)
+            or backend.known_version(session_id) == _turn_count(memory))
+
+
+@traced()
 def get_or_create_memory(session_id):
-    """Get or create memory for a session."""
-    if session_id not in sessions:
-        sessions[session_id] = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
-        logger.info(f"Created memory for session: {session_id}")
+    """Get or create memory for a session. May read the backend; see aget_or_create_memory."""
+    memory = sessions.get(session_id)
+    if memory is None:
+        # Load outside the shard lock; this session's own queued writes must land first
+        backend.wait_for(session_id)
+        loaded = _load_memory(session_id)
+        memory = sessions.get_or_create(session_id, lambda: loaded)
+    
+    # Another worker may have added turns since this process cached the session.
+    elif backend.persistent and not backend.has_pending(session_id):
+        if backend.version(session_id) != _turn_count(memory):
+            memory = _load_memory(session_id)
+            sessions.replace(session_id, memory)
+            logger.info(f"Reloaded memory for session: {session_id}")
     
-    return sessions[session_id]
+    return memory
+
 
+# Same span names as the sync versions, so /debug/traces stages stay comparable
+@traced("get_or_create_memory")
+async def aget_or_create_memory(session_id):
+    """get_or_create_memory for the event loop: storage is only read in a worker thread."""
+    memory = sessions.get(session_id)
+    if memory is not None and _is_current(session_id, memory):
+        return memory
+    return await asyncio.get_running_loop().run_in_executor(None, get_or_create_memory, session_id)
 
+
+@traced()
 def add_to_memory(session_id, user_input, ai_response):
     """Add user input and AI response to session memory."""
-    memory = get_or_create_memory(session_id)
-    memory.save_context(
-        {"input": user_input},
-        {"output": ai_response}
+    added_bytes = _turn_bytes(user_input, ai_response)
+    # An uncached session is not loaded here: with a persistent backend the next read loads it, turn included
+    sessions.update(
+        session_id,
+        None if backend.persistent else _new_memory,
+        lambda memory: memory.save_context({"input": user_input}, {"output": ai_response}),
+        added_bytes
     )
+    backend.append(session_id, user_input, ai_response)
     logger.info(f"Added message to session {session_id}")
 
 
+@traced()
 def get_memory_context(session_id):
     memory = get_or_create_memory(session_id)
     return memory.buffer
 
 
+@traced("get_memory_context")
+async def aget_memory_context(session_id):
+    memory = await aget_or_create_memory(session_id)
+    return memory.buffer
+
+
+async def summarize_if_needed(session_id):
+    """Fold turns older than the recent window into the session summary (window mode only).
+    
+    Runs once MEMORY_SUMMARY_BATCH_TURNS turns have built up past the recent
+    window, and folds all of them with a single summarization call.
+    """
+    if MEMORY_MODE != "window":
+        return
+    
+    def take_old_turns(memory):
+        if not memory.needs_summary:
+            return None
+        memory.summarizing = True
+        return memory.summary, memory.folded_turns, memory.turns[:-MEMORY_RECENT_TURNS]
+    
+    snapshot = sessions.update(session_id, None, take_old_turns)
+    if snapshot is None:
+        return
+    
+    summary, folded_before, old_turns = snapshot
+    transcript = "\n".join(f"Human: {user_input}\nAI: {ai_response}" for user_input, ai_response in old_turns)
+    try:
+        from app.llm import asummarize
+        new_summary = await asummarize(summary, transcript)
+    except Exception as e:
+        logger.error(f"Summarization failed for session {session_id}: {e}")
+        sessions.update(session_id, None, lambda memory: setattr(memory, "summarizing", False))
+        return
+    
+    def fold(memory):
+        if memory.folded_turns != folded_before:
+            # The session was reloaded from the backend meanwhile; drop this summary.
+            memory.summarizing = False
+            return None
+        # Turns appended while summarizing stay after the folded prefix.
+        del memory.turns[:len(old_turns)]
+        memory.summary = new_summary
+        memory.folded_turns += len(old_turns)
+        memory.summarizing = False
+        return memory.folded_turns
+    
+    removed_bytes = sum(_turn_bytes(user_input, ai_response) for user_input, ai_response in old_turns)
+    added_bytes = sys.getsizeof(new_summary) - sys.getsizeof(summary) - removed_bytes
+    # Sizes only change if the fold happened
+    folded_turns = sessions.update(session_id, None, fold, lambda folded: 0 if folded is None else added_bytes)
+    if folded_turns is None:
+        return
+    backend.save_summary(session_id, new_summary, folded_turns)
+    logger.info(f"Summarized {len(old_turns)} turns for session {session_id}")
+
+
 def clear_session(session_id):
-    if session_id in sessions:
-        del sessions[session_id]
+    backend.delete(session_id)
+    if sessions.delete(session_id):
         logger.info(f"Cleared memory for session: {session_id}")
+
+
+def close_backend():
+    """Flush pending writes and close the session backend."""
+    backend.close()
+
+
+def get_session_metrics():
+    """Get session store statistics."""
+    return sessions.stats()
@@ -1,33 +1,240 @@
+import itertools
+import os
+import threading
 import time
 from app.logging_utils import setup_logger
+from app.shared_metrics import METRICS_MODE, SharedMetrics
+from app.tracing import start_trace
 
 logger = setup_logger(__name__)
 
+# Histogram bucket upper bounds in seconds, and the throughput window
+LATENCY_BUCKETS = tuple(float(b) for b in os.getenv(
+    "LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60"
+).split(","))
+THROUGHPUT_WINDOW_SECONDS = int(os.getenv("THROUGHPUT_WINDOW_SECONDS", "60"))
+METRICS_STRIPES = int(os.getenv("METRICS_STRIPES", "8"))
+
+
+class _Stripe:
+    """One independently locked slice of a histogram."""
+    __slots__ = ("lock", "counts", "total", "window")
+    
+    def __init__(self, bucket_count, window_seconds):
+        self.lock = threading.Lock()
+        self.counts = [0] * (bucket_count + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.window = [[0, 0] for _ in range(window_seconds)]  # [second, count] ring
+
+
+class _CounterStripe:
+    """One independently locked slice of the request counters and in-flight gauges."""
+    __slots__ = ("lock", "request_count", "total_latency", "in_flight")
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.total_latency = 0.0
+        self.in_flight = {}  # operation name -> started minus finished on this stripe
+
+
+def _bucket_index(buckets, seconds):
+    for i, bound in enumerate(buckets):
+        if seconds <= bound:
+            return i
+    return len(buckets)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with a sliding-window request counter.
+    
+    Updates go to the stripes in turn (next() on an itertools.count is atomic
+    under the GIL, so picking one takes no lock), each with its own lock, so
+    concurrent recorders rarely meet on the same lock; reads merge the stripes.
+    """
+    
+    def __init__(self, buckets=LATENCY_BUCKETS, window_seconds=THROUGHPUT_WINDOW_SECONDS, stripes=METRICS_STRIPES):
+        self.buckets = buckets
+        self.window_seconds = window_seconds
+        self._stripes = [_Stripe(len(buckets), window_seconds) for _ in range(max(1, stripes))]
+        self._next_stripe = itertools.count()
+    
+    def observe(self, seconds):
+        index = _bucket_index(self.buckets, seconds)
+        now = int(time.time())
+        stripe = self._stripes[next(self._next_stripe) % len(self._stripes)]
+        with stripe.lock:
+            stripe.counts[index] += 1
+            stripe.total += seconds
+            slot = stripe.window[now % self.window_seconds]
+            if slot[0] != now:
+                slot[0], slot[1] = now, 0
+            slot[1] += 1
+    
+    def snapshot(self):
+        """Return (bucket counts, latency sum, requests in the sliding window)."""
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        recent = 0
+        oldest = int(time.time()) - self.window_seconds
+        for stripe in self._stripes:
+            with stripe.lock:
+                for i, count in enumerate(stripe.counts):
+                    counts[i] += count
+                total += stripe.total
+                recent += sum(count for second, count in stripe.window if second > oldest)
+        return counts, total, recent
+    
+    def reset(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.counts = [0] * len(stripe.counts)
+                stripe.total = 0.0
+                stripe.window = [[0, 0] for _ in range(self.window_seconds)]
+
+
+def _merge(snapshots):
+    counts, total, recent = None, 0.0, 0
+    for snapshot_counts, snapshot_total, snapshot_recent in snapshots:
+        counts = list(snapshot_counts) if counts is None else [a + b for a, b in zip(counts, snapshot_counts)]
+        total += snapshot_total
+        recent += snapshot_recent
+    return (counts or [0] * (len(LATENCY_BUCKETS) + 1)), total, recent
+
+
+def _percentile(counts, buckets, q):
+    """Estimate a percentile by linear interpolation inside its bucket."""
+    count = sum(counts)
+    if count == 0:
+        return 0.0
+    rank = q * count
+    seen = 0
+    for i, bucket_count in enumerate(counts):
+        if bucket_count and seen + bucket_count >= rank:
+            if i == len(buckets):
+                return buckets[-1]  # beyond the last bound; report the bound
+            lower = buckets[i - 1] if i > 0 else 0.0
+            return lower + (buckets[i] - lower) * (rank - seen) / bucket_count
+        seen += bucket_count
+    return buckets[-1]
+
+
+def _summary(snapshot, buckets, window_seconds):
+    counts, total, recent = snapshot
+    count = sum(counts)
+    return {
+        "count": count,
+        "average_latency": total / count if count else 0.0,
+        "p50": _percentile(counts, buckets, 0.50),
+        "p95": _percentile(counts, buckets, 0.95),
+        "p99": _percentile(counts, buckets, 0.99),
+        "requests_per_second": recent / window_seconds
+    }
+
 
 class MetricsStore:
+    """Process-wide request metrics.
+    
+    Request counters and in-flight gauges are striped like the histograms,
+    so recording a request takes no store-wide lock. With METRICS_MODE=shared,
+    requests are recorded in this worker's memory-mapped file and reads
+    aggregate the files of every worker.
+    """
     _instance = None
-    _request_count = 0
-    _total_latency = 0.0
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(MetricsStore, cls).__new__(cls)
+            cls._instance._init()
         return cls._instance
     
-    def increment_request(self, latency):
-        """Increment request count and add latency."""
-        self._request_count += 1
-        self._total_latency += latency
-        return self._request_count, self._total_latency
+    def _init(self):
+        self._lock = threading.Lock()  # guards creating histograms
+        self._stripes = [_CounterStripe() for _ in range(max(1, METRICS_STRIPES))]
+        self._next_stripe = itertools.count()
+        self._histograms = {}  # (route, prompt_variant) -> LatencyHistogram
+        self._shared = SharedMetrics(LATENCY_BUCKETS, THROUGHPUT_WINDOW_SECONDS) if METRICS_MODE == "shared" else None
+    
+    def increment_request(self, latency, route="unknown", prompt_variant="none"):
+        """Increment request count and add latency; returns this worker's (count, latency sum)."""
+        key = (route, prompt_variant)
+        if self._shared is not None:
+            return self._shared.observe(key, latency, _bucket_index(LATENCY_BUCKETS, latency))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        histogram.observe(latency)
+        
+        stripe = self._stripe()
+        with stripe.lock:
+            stripe.request_count += 1
+            stripe.total_latency += latency
+        # Unlocked sum: other stripes may be mid-update, which is fine for the log line
+        return (sum(stripe.request_count for stripe in self._stripes),
+                sum(stripe.total_latency for stripe in self._stripes))
+    
+    def _stripe(self):
+        return self._stripes[next(self._next_stripe) % len(self._stripes)]
     
     def get_stats(self):
         """Get current statistics."""
-        return self._request_count, self._total_latency
+        if self._shared is not None:
+            request_count, total_latency, _, _ = self._shared.aggregate()
+            return request_count, total_latency
+        request_count, total_latency = 0, 0.0
+        for stripe in self._stripes:
+            with stripe.lock:
+                request_count += stripe.request_count
+                total_latency += stripe.total_latency
+        return request_count, total_latency
+    
+    def histogram_snapshots(self):
+        """Return {(route, prompt_variant): (bucket counts, latency sum, recent requests)}."""
+        if self._shared is not None:
+            return self._shared.aggregate()[2]
+        with self._lock:
+            histograms = list(self._histograms.items())
+        return {key: histogram.snapshot() for key, histogram in histograms}
+    
+    def _add_in_flight(self, operation, delta):
+        # begin and end may land on different stripes; only the sum is meaningful
+        stripe = self._stripe()
+        with stripe.lock:
+            stripe.in_flight[operation] = stripe.in_flight.get(operation, 0) + delta
+    
+    def begin(self, operation):
+        if self._shared is not None:
+            self._shared.add_in_flight(operation, 1)
+            return
+        self._add_in_flight(operation, 1)
+    
+    def end(self, operation):
+        if self._shared is not None:
+            self._shared.add_in_flight(operation, -1)
+            return
+        self._add_in_flight(operation, -1)
+    
+    def in_flight(self):
+        if self._shared is not None:
+            return self._shared.aggregate()[3]
+        totals = {}
+        for stripe in self._stripes:
+            with stripe.lock:
+                for operation, count in stripe.in_flight.items():
+                    totals[operation] = totals.get(operation, 0) + count
+        return totals
     
     def reset(self):
         """Reset all metrics."""
-        self._request_count = 0
-        self._total_latency = 0.0
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.request_count = 0
+                stripe.total_latency = 0.0
+        with self._lock:
+            histograms = list(self._histograms.values())
+        for histogram in histograms:
+            histogram.reset()
 
 _metrics = MetricsStore()
 
@@ -38,14 +245,20 @@ class RequestTimer:
         self.operation_name = operation_name
         self.start_time = None
         self.elapsed = None
+        self._trace = None
     
     def __enter__(self):
         self.start_time = time.time()
+        _metrics.begin(self.operation_name)
+        self._trace = start_trace(self.operation_name)
+        self._trace.__enter__()
         logger.info(f"[TIMER] Started: {self.operation_name}")
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.elapsed = time.time() - self.start_time
+        _metrics.end(self.operation_name)
+        self._trace.__exit__(exc_type, exc_val, exc_tb)
         
         if exc_type is not None:
             logger.error(f"[TIMER] Failed: {self.operation_name} - Exception: {exc_type.__name__}")
@@ -55,7 +268,7 @@ class RequestTimer:
         return False
 
 
-def record_request(latency_seconds, session_id=None, route_taken=None, message_preview=None):
+def record_request(latency_seconds, session_id=None, route_taken=None, message_preview=None, prompt_variant=None):
     """Log a completed request and update metrics."""
     # Handle None latency
     if latency_seconds is None:
@@ -63,7 +276,11 @@ def record_request(latency_seconds, session_id=None, route_taken=None, message_p
         return
     
     # Use singleton to increment and get current count
-    request_count, total_latency = _metrics.increment_request(latency_seconds)
+    request_count, total_latency = _metrics.increment_request(
+        latency_seconds,
+        route=(route_taken or "unknown").lower(),
+        prompt_variant=prompt_variant or "none"
+    )
     
     avg_latency = total_latency / request_count
     
@@ -104,8 +321,60 @@ def get_metrics():
     logger.info(f"Total Latency: {total_latency:.3f}s")
     logger.info(f"Average Latency: {avg_latency:.3f}s")
     
+    snapshots = _metrics.histogram_snapshots()
+    by_route, by_variant = {}, {}
+    for (route, variant), snapshot in snapshots.items():
+        by_route.setdefault(route, []).append(snapshot)
+        by_variant.setdefault(variant, []).append(snapshot)
+    
+    def summarize(groups):
+        return {name: _summary(_merge(group), LATENCY_BUCKETS, THROUGHPUT_WINDOW_SECONDS) for name, group in sorted(groups.items())}
+    
     return {
         "request_count": request_count,
         "total_latency": total_latency,
-        "average_latency": avg_latency
+        "average_latency": avg_latency,
+        "latency": _summary(_merge(snapshots.values()), LATENCY_BUCKETS, THROUGHPUT_WINDOW_SECONDS),
+        "latency_by_route": summarize(by_route),
+        "latency_by_variant": summarize(by_variant),
+        "throughput_window_seconds": THROUGHPUT_WINDOW_SECONDS,
+        "in_flight": _metrics.in_flight()
     }
+
+
+def _format_labels(labels):
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def get_prometheus_metrics():
+    """Render the request metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP chat_request_latency_seconds Chat request latency by route and prompt variant.",
+        "# TYPE chat_request_latency_seconds histogram",
+    ]
+    snapshots = _metrics.histogram_snapshots()
+    for (route, variant), (counts, total, recent) in sorted(snapshots.items()):
+        labels = [("route", route), ("prompt_variant", variant)]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"chat_request_latency_seconds_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+        lines.append(f"chat_request_latency_seconds_sum{_format_labels(labels)} {total}")
+        lines.append(f"chat_request_latency_seconds_count{_format_labels(labels)} {cumulative}")
+    
+    lines.append(f"# HELP chat_requests_per_second Requests per second over the last {THROUGHPUT_WINDOW_SECONDS}s.")
+    lines.append("# TYPE chat_requests_per_second gauge")
+    for (route, variant), (counts, total, recent) in sorted(snapshots.items()):
+        labels = [("route", route), ("prompt_variant", variant)]
+        lines.append(f"chat_requests_per_second{_format_labels(labels)} {recent / THROUGHPUT_WINDOW_SECONDS}")
+    
+    lines.append("# HELP chat_requests_in_flight Requests currently being processed.")
+    lines.append("# TYPE chat_requests_in_flight gauge")
+    for operation, count in sorted(_metrics.in_flight().items()):
+        lines.append(f"chat_requests_in_flight{_format_labels([('operation', operation)])} {count}")
+    return "\n".join(lines) + "\n"
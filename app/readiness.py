@@ -0,0 +1,98 @@
+import asyncio
+import os
+import time
+from app.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Upstream keep-alive: ping Gemini this often (0 disables) so its connection stays open
+READY_KEEPALIVE_SECONDS = float(os.getenv("READY_KEEPALIVE_SECONDS", "60"))
+READY_PING_TIMEOUT_SECONDS = float(os.getenv("READY_PING_TIMEOUT_SECONDS", "10"))
+
+
+class Readiness:
+    """Tracks whether this instance is hot: graph compiled, chains built, upstream connected.
+    
+    The upstream check goes stale when no ping has succeeded for three
+    keep-alive intervals, so an instance that lost Gemini stops reporting ready.
+    """
+    
+    def __init__(self, keepalive_seconds=READY_KEEPALIVE_SECONDS, ping_timeout=READY_PING_TIMEOUT_SECONDS):
+        self.keepalive_seconds = keepalive_seconds
+        self.ping_timeout = ping_timeout
+        self.graph = False
+        self.prompts = False
+        self.upstream_at = None  # time.monotonic() of the last successful ping
+        self.upstream_latency = None
+        self.upstream_error = None
+        self.pings = 0
+        self._task = None
+    
+    async def ping_upstream(self):
+        """Open or refresh the pooled Gemini connection; returns True on success."""
+        from app.llm import get_llm
+        self.pings += 1
+        start = time.monotonic()
+        try:
+            llm = get_llm()
+            ping = getattr(llm, "aping", None)
+            if ping is not None:
+                await ping(timeout=self.ping_timeout)
+        except Exception as e:
+            self.upstream_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Upstream ping failed: {self.upstream_error}")
+            return False
+        self.upstream_at = time.monotonic()
+        self.upstream_latency = self.upstream_at - start
+        self.upstream_error = None
+        return True
+    
+    def upstream_ready(self):
+        if self.upstream_at is None:
+            return False
+        if self.keepalive_seconds <= 0:
+            return True
+        return time.monotonic() - self.upstream_at < 3 * self.keepalive_seconds
+    
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.keepalive_seconds)
+            await self.ping_upstream()
+    
+    def start(self, warm_up):
+        """Run warm_up() (graph and chains), the first ping and then the keep-alive in the background."""
+        async def run():
+            try:
+                await warm_up()
+            except Exception:
+                pass  # logged by the loader; requests retry it
+            await self.ping_upstream()
+            if self.keepalive_seconds > 0:
+                await self._keepalive()
+        self._task = asyncio.ensure_future(run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    def status(self):
+        """Return (ready, checks)."""
+        upstream = self.upstream_ready()
+        checks = {
+            "graph": self.graph,
+            "prompts": self.prompts,
+            "upstream": upstream,
+            "upstream_age_seconds": None if self.upstream_at is None else time.monotonic() - self.upstream_at,
+            "upstream_latency_seconds": self.upstream_latency,
+            "keepalive_seconds": self.keepalive_seconds
+        }
+        if self.upstream_error is not None:
+            checks["upstream_error"] = self.upstream_error
+        return self.graph and self.prompts and upstream, checks
+
+
+readiness = Readiness()
@@ -0,0 +1,351 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from app.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Per-request deadline and retry policy for upstream LLM calls
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.2"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "2"))
+
+# Hedged requests: start a second attempt once the first is slower than this percentile
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Circuit breaker: stop calling the LLM while most recent calls fail or are slow
+LLM_BREAKER_ENABLED = os.getenv("LLM_BREAKER_ENABLED", "true").lower() == "true"
+LLM_BREAKER_WINDOW_SECONDS = float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "30"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_SLOW_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "10"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "15"))
+LLM_BREAKER_PROBES = int(os.getenv("LLM_BREAKER_PROBES", "1"))
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The request deadline passed before the LLM answered."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The circuit breaker is open; the LLM was not called."""
+
+
+_transient_errors = None
+
+
+def transient_errors():
+    """Upstream errors worth another attempt (google.api_core is imported on first use)."""
+    global _transient_errors
+    if _transient_errors is None:
+        from google.api_core import exceptions as google_exceptions
+        _transient_errors = (
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.TooManyRequests,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+            ConnectionError
+        )
+    return _transient_errors
+
+
+def deadline_after(seconds=LLM_REQUEST_TIMEOUT_SECONDS):
+    """Absolute deadline (time.monotonic() based) `seconds` from now."""
+    return time.monotonic() + seconds
+
+
+def remaining(deadline):
+    """Seconds left before the deadline; None means no deadline."""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class LatencyTracker:
+    """Recent first-attempt latencies, used to pick the hedge delay.
+    
+    Cancelled attempts contribute the time they ran before cancellation.
+    """
+    
+    def __init__(self, size=512, percentile=LLM_HEDGE_PERCENTILE, min_samples=LLM_HEDGE_MIN_SAMPLES):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._threshold = None
+        self._since_update = 0
+    
+    def observe(self, seconds):
+        self._samples.append(seconds)
+        self._since_update += 1
+        # Re-sort only every few samples; the threshold moves slowly
+        if self._threshold is None or self._since_update >= 32:
+            self._since_update = 0
+            if len(self._samples) >= self.min_samples:
+                ordered = sorted(self._samples)
+                self._threshold = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+    
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None until enough samples are in."""
+        return self._threshold
+
+
+class UpstreamPolicy:
+    """Run an upstream call within a deadline, with jittered retries and optional hedging."""
+    
+    def __init__(self, max_retries=LLM_MAX_RETRIES, retry_base_seconds=LLM_RETRY_BASE_SECONDS,
+                 retry_max_seconds=LLM_RETRY_MAX_SECONDS, hedge_enabled=LLM_HEDGE_ENABLED):
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.hedge_enabled = hedge_enabled
+        self.latency = LatencyTracker()
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+    
+    async def _timed(self, call, observe=True):
+        self.attempts += 1
+        if not observe:
+            return await call()
+        start = time.monotonic()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # A cancelled attempt (lost the hedge race or hit the deadline) took at
+            # least this long. Recording only finished attempts would drop the slow
+            # ones and pull the hedge delay down.
+            self.latency.observe(time.monotonic() - start)
+            raise
+        self.latency.observe(time.monotonic() - start)
+        return result
+    
+    async def _attempt(self, call, deadline):
+        """One attempt, hedged with a second one if it runs past the hedge delay."""
+        first = asyncio.ensure_future(self._timed(call))
+        tasks = [first]
+        try:
+            delay = self.latency.hedge_delay() if self.hedge_enabled else None
+            left = remaining(deadline)
+            if delay is not None and (left is None or delay < left):
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.hedges += 1
+                    # Hedges are not observed: one that loses is cancelled early,
+                    # and one that wins is faster than usual by selection
+                    tasks.append(asyncio.ensure_future(self._timed(call, observe=False)))
+            
+            # First successful answer wins; an error only counts once every attempt failed
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=remaining(deadline),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise LLMDeadlineExceeded("LLM request deadline exceeded")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def call(self, call, deadline=None):
+        """Await call() until it succeeds, fails for good, or the deadline passes."""
+        if deadline is None:
+            deadline = deadline_after()
+        attempt = 0
+        while True:
+            if remaining(deadline) <= 0:
+                self.deadline_exceeded += 1
+                raise LLMDeadlineExceeded("LLM request deadline exceeded")
+            try:
+                return await self._attempt(call, deadline)
+            except LLMDeadlineExceeded:
+                self.deadline_exceeded += 1
+                raise
+            except transient_errors() as e:
+                attempt += 1
+                # Full jitter keeps retries from many requests from arriving together
+                backoff = random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (attempt - 1)))
+                if attempt > self.max_retries or remaining(deadline) <= backoff:
+                    raise
+                self.retries += 1
+                logger.warning(f"Transient LLM error ({type(e).__name__}: {e}); retry {attempt} in {backoff:.2f}s")
+                await asyncio.sleep(backoff)
+    
+    def stats(self):
+        return {
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "hedge_enabled": self.hedge_enabled,
+            "hedge_delay_seconds": self.latency.hedge_delay(),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "deadline_exceeded": self.deadline_exceeded
+        }
+
+
+upstream = UpstreamPolicy()
+
+
+async def with_deadline(awaitable, deadline):
+    """Await within the deadline, raising LLMDeadlineExceeded when it passes."""
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=max(0.0, remaining(deadline)))
+    except asyncio.TimeoutError:
+        raise LLMDeadlineExceeded("LLM request deadline exceeded") from None
+
+
+async def stream_with_deadline(chunks, deadline):
+    """Re-yield an async iterator, stopping with LLMDeadlineExceeded at the deadline."""
+    if deadline is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+    iterator = chunks.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await with_deadline(iterator.__anext__(), deadline)
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a rolling window of call outcomes.
+    
+    A call fails if it raises or takes longer than slow_seconds. Once the
+    window holds min_calls and the failure rate reaches failure_rate, the
+    breaker opens and rejects calls for open_seconds. It then lets `probes`
+    calls through (half-open): a success closes it, a failure opens it again.
+    """
+    
+    def __init__(self, enabled=LLM_BREAKER_ENABLED, window_seconds=LLM_BREAKER_WINDOW_SECONDS,
+                 min_calls=LLM_BREAKER_MIN_CALLS, failure_rate=LLM_BREAKER_FAILURE_RATE,
+                 slow_seconds=LLM_BREAKER_SLOW_SECONDS, open_seconds=LLM_BREAKER_OPEN_SECONDS,
+                 probes=LLM_BREAKER_PROBES):
+        self.enabled = enabled
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (finished_at, failed), oldest first
+        self._failures = 0
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.transitions = {"open": 0, "half_open": 0, "closed": 0}
+        self.rejected = 0
+    
+    def _prune(self, now):
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            if self._outcomes.popleft()[1]:
+                self._failures -= 1
+    
+    def _transition(self, state, now):
+        logger.warning(f"LLM circuit breaker {self.state} -> {state}")
+        self.state = state
+        self.transitions[state] += 1
+        if state == "open":
+            self._opened_at = now
+        self._outcomes.clear()
+        self._failures = 0
+        self._probes_in_flight = 0
+    
+    def allow(self):
+        """Return True if a call may go ahead; the caller must then record() it."""
+        if not self.enabled:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.open_seconds:
+                self._transition("half_open", now)
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and self._probes_in_flight < self.probes:
+                self._probes_in_flight += 1
+                return True
+            self.rejected += 1
+            return False
+    
+    def record(self, failed, seconds=0.0):
+        """Record the outcome of an allowed call."""
+        if not self.enabled:
+            return
+        failed = failed or seconds > self.slow_seconds
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "half_open":
+                self._transition("open" if failed else "closed", now)
+                return
+            if self.state == "open":
+                return  # a call started before the breaker opened
+            self._outcomes.append((now, failed))
+            self._failures += failed
+            self._prune(now)
+            if len(self._outcomes) >= self.min_calls and self._failures / len(self._outcomes) >= self.failure_rate:
+                self._transition("open", now)
+    
+    def release(self):
+        """Give back an allowed call that ended without an outcome (cancelled)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.state == "half_open" and self._probes_in_flight:
+                self._probes_in_flight -= 1
+    
+    async def call(self, call):
+        """Await call() if the breaker allows it, else raise CircuitOpenError."""
+        if not self.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+        start = time.monotonic()
+        try:
+            result = await call()
+        except Exception:
+            self.record(True)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record(False, time.monotonic() - start)
+        return result
+    
+    def stats(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            calls = len(self._outcomes)
+            return {
+                "enabled": self.enabled,
+                "state": self.state,
+                "window_calls": calls,
+                "window_failure_rate": self._failures / calls if calls else 0.0,
+                "transitions": dict(self.transitions),
+                "rejected": self.rejected
+            }
+
+
+breaker = CircuitBreaker()
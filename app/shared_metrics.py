@@ -0,0 +1,313 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from app.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# "process" keeps metrics in each worker; "shared" writes them to one
+# memory-mapped file per worker so any worker can report the totals.
+METRICS_MODE = os.getenv("METRICS_MODE", "process")
+METRICS_DIR = os.getenv("METRICS_DIR", "data/metrics")
+METRICS_SHARED_SLOTS = int(os.getenv("METRICS_SHARED_SLOTS", "64"))
+# Workers with the same group id report each other's metrics; the launcher
+# sets a new one for each server start so counters restart from zero.
+METRICS_GROUP = os.getenv("METRICS_GROUP", "default")
+
+_MAGIC = b"CHATMET1"
+_HEADER = struct.Struct("<8sqqqqqd")  # magic, pid, buckets, window, slots, request count, latency sum
+_NAME_BYTES = 64
+_OPERATION_SLOTS = 16
+_OPERATION = struct.Struct(f"<{_NAME_BYTES}sq")  # name, requests in flight
+
+
+class _Layout:
+    """Offsets of the histogram and in-flight slots for one file shape."""
+    
+    def __init__(self, bucket_count, window_seconds, slots):
+        self.bucket_count = bucket_count
+        self.window_seconds = window_seconds
+        self.slots = slots
+        # name, bucket counts (+Inf last), latency sum, [second, count] ring
+        self.slot = struct.Struct(f"<{_NAME_BYTES}s{bucket_count + 1}qd{2 * window_seconds}q")
+        self.counts_offset = _NAME_BYTES
+        self.total_offset = _NAME_BYTES + 8 * (bucket_count + 1)
+        self.window_offset = self.total_offset + 8
+        self.operations_offset = _HEADER.size + slots * self.slot.size
+        self.size = self.operations_offset + _OPERATION_SLOTS * _OPERATION.size
+    
+    def slot_offset(self, index):
+        return _HEADER.size + index * self.slot.size
+
+
+def _encode_name(name):
+    return name.encode("utf-8")[:_NAME_BYTES]
+
+
+def _decode_name(raw):
+    return raw.rstrip(b"\0").decode("utf-8", "replace")
+
+
+def _histogram_name(key):
+    return "\x1f".join(key)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsFile:
+    """One worker's metrics in a memory-mapped file.
+    
+    Only the owning process writes (under a thread lock); other workers read
+    the mapping directly, so aggregation needs no IPC. Values are aligned
+    8-byte words, so a concurrent reader sees each one whole.
+    """
+    
+    def __init__(self, path, layout, pid):
+        self.path = path
+        self.layout = layout
+        self._lock = threading.Lock()
+        created = not path.exists()
+        with open(path, "a+b") as f:
+            if created or os.fstat(f.fileno()).st_size != layout.size:
+                f.truncate(0)
+                f.truncate(layout.size)
+                created = True
+            self._map = mmap.mmap(f.fileno(), layout.size)
+        if created:
+            _HEADER.pack_into(self._map, 0, _MAGIC, pid, layout.bucket_count, layout.window_seconds, layout.slots, 0, 0.0)
+        self._slots = {}  # name -> slot index
+        self._operations = {}  # operation -> slot index
+        for index in range(layout.slots):
+            name = self._slot_name(index)
+            if name:
+                self._slots[name] = index
+        for index in range(_OPERATION_SLOTS):
+            name, _ = _OPERATION.unpack_from(self._map, layout.operations_offset + index * _OPERATION.size)
+            if name.strip(b"\0"):
+                self._operations[_decode_name(name)] = index
+    
+    def _slot_name(self, index):
+        offset = self.layout.slot_offset(index)
+        return _decode_name(self._map[offset:offset + _NAME_BYTES])
+    
+    def _word(self, fmt, offset, delta):
+        value = struct.unpack_from(fmt, self._map, offset)[0] + delta
+        struct.pack_into(fmt, self._map, offset, value)
+        return value
+    
+    def _slot_for(self, name):
+        index = self._slots.get(name)
+        if index is None:
+            if len(self._slots) >= self.layout.slots:
+                # Table full: fold further keys into the last slot
+                return self.layout.slots - 1
+            index = len(self._slots)
+            offset = self.layout.slot_offset(index)
+            self._map[offset:offset + _NAME_BYTES] = _encode_name(name).ljust(_NAME_BYTES, b"\0")
+            self._slots[name] = index
+            if index == self.layout.slots - 1:
+                logger.warning(f"Shared metrics table full; further routes and variants are merged into '{name}'")
+        return index
+    
+    def observe(self, key, seconds, bucket_index, now):
+        """Record one request; returns this worker's (request count, latency sum)."""
+        layout = self.layout
+        with self._lock:
+            offset = layout.slot_offset(self._slot_for(_histogram_name(key)))
+            self._word("<q", offset + layout.counts_offset + 8 * bucket_index, 1)
+            self._word("<d", offset + layout.total_offset, seconds)
+            ring = offset + layout.window_offset + 16 * (now % layout.window_seconds)
+            second, count = struct.unpack_from("<qq", self._map, ring)
+            struct.pack_into("<qq", self._map, ring, now, count + 1 if second == now else 1)
+            count = self._word("<q", 40, 1)
+            total = self._word("<d", 48, seconds)
+            return count, total
+    
+    def add_in_flight(self, operation, delta):
+        with self._lock:
+            index = self._operations.get(operation)
+            if index is None:
+                if len(self._operations) >= _OPERATION_SLOTS:
+                    return
+                index = self._operations[operation] = len(self._operations)
+                offset = self.layout.operations_offset + index * _OPERATION.size
+                _OPERATION.pack_into(self._map, offset, _encode_name(operation), 0)
+            self._word("<q", self.layout.operations_offset + index * _OPERATION.size + _NAME_BYTES, delta)
+    
+    def read(self):
+        """Return (request count, latency sum, {key: (counts, total, window)}, {operation: in flight})."""
+        layout = self.layout
+        _, _, _, _, _, request_count, total_latency = _HEADER.unpack_from(self._map, 0)
+        histograms = {}
+        for index in range(layout.slots):
+            values = layout.slot.unpack_from(self._map, layout.slot_offset(index))
+            name = _decode_name(values[0])
+            if not name:
+                continue
+            counts = list(values[1:layout.bucket_count + 2])
+            total = values[layout.bucket_count + 2]
+            window = values[layout.bucket_count + 3:]
+            histograms[tuple(name.split("\x1f", 1)) if "\x1f" in name else (name, "none")] = (counts, total, window)
+        operations = {}
+        for index in range(_OPERATION_SLOTS):
+            name, count = _OPERATION.unpack_from(self._map, layout.operations_offset + index * _OPERATION.size)
+            if name.strip(b"\0"):
+                operations[_decode_name(name)] = count
+        return request_count, total_latency, histograms, operations
+    
+    def absorb(self, request_count, total_latency, histograms):
+        """Add a dead worker's cumulative counts (not its window or in-flight gauges)."""
+        layout = self.layout
+        with self._lock:
+            self._word("<q", 40, request_count)
+            self._word("<d", 48, total_latency)
+            for key, (counts, total, _) in histograms.items():
+                offset = layout.slot_offset(self._slot_for(_histogram_name(key)))
+                for i, count in enumerate(counts):
+                    self._word("<q", offset + layout.counts_offset + 8 * i, count)
+                self._word("<d", offset + layout.total_offset, total)
+    
+    def close(self):
+        self._map.close()
+
+
+class SharedMetrics:
+    """Metrics for all workers of one server, one mapped file per worker.
+    
+    Files are grouped by METRICS_GROUP. Workers, and restarts of them, that
+    share a group id add up to one set of counters; a server started with a
+    new group id starts from zero. When a reader finds a file whose worker
+    has exited, it adds that worker's counters to the group's "retired" file
+    and deletes it; files of other groups whose workers have all exited are
+    deleted outright.
+    
+    The worker's own file is created on first use in that process, so
+    workers forked after import (gunicorn --preload) each get their own.
+    """
+    
+    def __init__(self, buckets, window_seconds, directory=METRICS_DIR, slots=METRICS_SHARED_SLOTS, group=METRICS_GROUP):
+        self.buckets = buckets
+        self.window_seconds = window_seconds
+        # "-" separates the group from the worker pid in file names
+        self.group = group.replace("-", "_").replace(os.sep, "_")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.layout = _Layout(len(buckets), window_seconds, slots)
+        self._lock = threading.Lock()
+        self.pid = None
+        self._own = None
+        self._readers = {}  # path -> MetricsFile of other workers
+    
+    def _own_file(self):
+        if self.pid != os.getpid():
+            with self._lock:
+                if self.pid != os.getpid():
+                    self._readers = {}
+                    self._own = MetricsFile(self.directory / f"{self.group}-{os.getpid()}.metrics", self.layout, os.getpid())
+                    self.pid = os.getpid()
+                    logger.info(f"Shared metrics file {self._own.path}")
+        return self._own
+    
+    def observe(self, key, seconds, bucket_index):
+        return self._own_file().observe(key, seconds, bucket_index, int(time.time()))
+    
+    def add_in_flight(self, operation, delta):
+        self._own_file().add_in_flight(operation, delta)
+    
+    def _open(self, path):
+        reader = self._readers.get(path)
+        if reader is None:
+            try:
+                if path.stat().st_size != self.layout.size:
+                    return None
+                with open(path, "rb") as f:
+                    if f.read(len(_MAGIC)) != _MAGIC:
+                        return None
+                reader = self._readers[path] = MetricsFile(path, self.layout, 0)
+            except OSError:
+                return None
+        return reader
+    
+    def _retire(self, path, pid):
+        """Fold an exited worker's counters into the retired file and delete its file."""
+        import fcntl  # shared mode is for multi-worker (Unix) deployments
+        with open(self.directory / f"{self.group}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not path.exists():
+                return  # another worker retired it first
+            dead = self._open(path)
+            if dead is not None:
+                request_count, total_latency, histograms, _ = dead.read()
+                retired = MetricsFile(self.directory / f"{self.group}-retired.metrics", self.layout, 0)
+                retired.absorb(request_count, total_latency, histograms)
+                retired.close()
+            path.unlink()
+        reader = self._readers.pop(path, None)
+        if reader is not None:
+            reader.close()
+        logger.info(f"Retired metrics of exited worker {pid}")
+    
+    def _scan(self):
+        """Yield (path, group, worker pid or None for the retired file) for every metrics file."""
+        for path in sorted(self.directory.glob("*.metrics")):
+            group, _, worker = path.stem.rpartition("-")
+            try:
+                yield path, group, None if worker == "retired" else int(worker)
+            except ValueError:
+                continue
+    
+    def _files(self):
+        """Return the mapped files of this server's workers, cleaning up after exited ones."""
+        own = self._own_file()
+        live_groups, stale = set(), []
+        for path, group, worker in list(self._scan()):
+            if group == self.group:
+                if worker is not None and worker != self.pid and not _pid_alive(worker):
+                    self._retire(path, worker)
+            elif worker is not None and _pid_alive(worker):
+                live_groups.add(group)
+            else:
+                stale.append((path, group))
+        for path, group in stale:
+            if group not in live_groups:
+                path.unlink(missing_ok=True)
+                (self.directory / f"{group}.lock").unlink(missing_ok=True)
+        
+        files = []
+        for path, group, worker in self._scan():
+            if group == self.group:
+                metrics_file = own if path == own.path else self._open(path)
+                if metrics_file is not None:
+                    files.append(metrics_file)
+        return files
+    
+    def aggregate(self):
+        """Return (request count, latency sum, {key: (counts, total, recent)}, in flight) over all workers."""
+        oldest = int(time.time()) - self.window_seconds
+        request_count, total_latency = 0, 0.0
+        histograms, in_flight = {}, {}
+        for metrics_file in self._files():
+            count, total, file_histograms, operations = metrics_file.read()
+            request_count += count
+            total_latency += total
+            for key, (counts, key_total, window) in file_histograms.items():
+                recent = sum(window[i + 1] for i in range(0, len(window), 2) if window[i] > oldest)
+                merged = histograms.get(key)
+                if merged is None:
+                    histograms[key] = (counts, key_total, recent)
+                else:
+                    histograms[key] = ([a + b for a, b in zip(merged[0], counts)], merged[1] + key_total, merged[2] + recent)
+            for operation, count in operations.items():
+                in_flight[operation] = in_flight.get(operation, 0) + count
+        return request_count, total_latency, histograms, in_flight
@@ -0,0 +1,309 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from app.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# "memory" keeps sessions in this process only; "sqlite" persists them so
+# several workers can share conversation history.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/sessions.db")
+SQLITE_FLUSH_INTERVAL = float(os.getenv("SQLITE_FLUSH_INTERVAL", "0.05"))
+SQLITE_BATCH_SIZE = int(os.getenv("SQLITE_BATCH_SIZE", "256"))
+
+
+class SessionBackend:
+    """Storage interface behind app.memory. The base class keeps nothing (in-process only)."""
+    
+    persistent = False
+    
+    def load_turns(self, session_id, after=0):
+        """Return [(user_input, ai_response), ...] with sequence number > after, oldest first."""
+        return []
+    
+    def load_summary(self, session_id):
+        """Return (summary, folded_turns) for a session."""
+        return "", 0
+    
+    def version(self, session_id):
+        """Return the number of turns stored for a session."""
+        return 0
+    
+    def known_version(self, session_id):
+        """Return version() if it is known without reading storage, else None."""
+        return 0
+    
+    def has_pending(self, session_id):
+        """Return True if this process has unflushed writes for a session."""
+        return False
+    
+    def wait_for(self, session_id):
+        """Block until this process's queued writes for one session are committed."""
+        pass
+    
+    def append(self, session_id, user_input, ai_response):
+        pass
+    
+    def save_summary(self, session_id, summary, folded_turns):
+        pass
+    
+    def delete(self, session_id):
+        pass
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        pass
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """SQLite (WAL mode) backend with a write-behind queue.
+    
+    Writes are queued and applied by a background thread in batched
+    transactions, so requests never wait on disk. Reads use a separate
+    connection; WAL lets them run alongside the writer and other workers.
+    
+    Each session's turn count (its version) is kept in memory once read,
+    and the writer updates it as it commits. While idle, the writer polls
+    `PRAGMA data_version`, which changes only when another process commits;
+    the cached versions are then dropped, so another worker's turns are
+    noticed within about flush_interval.
+    """
+    
+    persistent = True
+    
+    def __init__(self, path=SQLITE_PATH, flush_interval=SQLITE_FLUSH_INTERVAL, batch_size=SQLITE_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._read_conn = self._connect()
+        self._read_lock = threading.Lock()
+        self._create_schema(self._read_conn)
+        
+        self._queue = queue.Queue()
+        self._pending = {}  # session_id -> queued writes not yet committed
+        self._pending_lock = threading.Lock()
+        self._committed = threading.Condition(self._pending_lock)
+        self._versions = {}  # session_id -> turns stored, guarded by _pending_lock
+        self._generation = 0  # bumped whenever _versions changes under readers
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-write-behind", daemon=True)
+        self._writer.start()
+        logger.info(f"SQLite session backend opened: {path}")
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def _create_schema(self, conn):
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS turns (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                user_input TEXT NOT NULL,
+                ai_response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS summaries (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                folded_turns INTEGER NOT NULL
+            );
+        """)
+    
+    def _remember(self, session_id, version, generation):
+        """Cache a version read from storage unless a commit or invalidation happened meanwhile."""
+        with self._pending_lock:
+            if self._generation == generation:
+                self._versions[session_id] = version
+    
+    def load_turns(self, session_id, after=0):
+        generation = self._generation
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT user_input, ai_response FROM turns WHERE session_id = ? AND seq > ? ORDER BY seq",
+                (session_id, after)
+            ).fetchall()
+        self._remember(session_id, after + len(rows), generation)
+        return rows
+    
+    def load_summary(self, session_id):
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT summary, folded_turns FROM summaries WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        return row if row else ("", 0)
+    
+    def version(self, session_id):
+        known = self.known_version(session_id)
+        if known is not None:
+            return known
+        generation = self._generation
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM turns WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        self._remember(session_id, row[0], generation)
+        return row[0]
+    
+    def known_version(self, session_id):
+        with self._pending_lock:
+            return self._versions.get(session_id)
+    
+    def has_pending(self, session_id):
+        with self._pending_lock:
+            return session_id in self._pending
+    
+    def wait_for(self, session_id):
+        with self._committed:
+            self._committed.wait_for(lambda: session_id not in self._pending or self._closed)
+    
+    def _enqueue(self, op):
+        session_id = op[1]
+        with self._pending_lock:
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._queue.put(op)
+    
+    def append(self, session_id, user_input, ai_response):
+        self._enqueue(("append", session_id, user_input, ai_response, time.time()))
+    
+    def save_summary(self, session_id, summary, folded_turns):
+        self._enqueue(("summary", session_id, summary, folded_turns))
+    
+    def delete(self, session_id):
+        self._enqueue(("delete", session_id))
+    
+    def _check_foreign_commits(self, conn):
+        """Drop cached versions if another process committed since the last check."""
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            with self._pending_lock:
+                self._versions.clear()
+                self._generation += 1
+    
+    def _write_loop(self):
+        conn = self._connect()
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        while True:
+            try:
+                op = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._check_foreign_commits(conn)
+                continue
+            if op is None:
+                self._queue.task_done()
+                break
+            
+            batch = [op]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if op is None:
+                    self._queue.put(None)  # handle shutdown after this batch
+                    self._queue.task_done()
+                    break
+                batch.append(op)
+            
+            versions = {}
+            try:
+                self._check_foreign_commits(conn)
+                versions = self._write_batch(conn, batch)
+            except Exception as e:
+                logger.error(f"SQLite write-behind batch of {len(batch)} failed: {e}")
+            finally:
+                with self._pending_lock:
+                    self._generation += 1
+                    if len(versions) < len({op[1] for op in batch}):
+                        self._versions.clear()  # the batch failed; read versions from storage again
+                    self._versions.update(versions)
+                    for op in batch:
+                        session_id = op[1]
+                        remaining = self._pending.get(session_id, 0) - 1
+                        if remaining > 0:
+                            self._pending[session_id] = remaining
+                        else:
+                            self._pending.pop(session_id, None)
+                    self._committed.notify_all()
+                for _ in batch:
+                    self._queue.task_done()
+        conn.close()
+    
+    def _write_batch(self, conn, batch):
+        """Apply a batch in one transaction; returns {session_id: turns stored} for the sessions it touched."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for op in batch:
+                kind, session_id = op[0], op[1]
+                if kind == "append":
+                    _, _, user_input, ai_response, created_at = op
+                    conn.execute(
+                        "INSERT INTO turns (session_id, seq, user_input, ai_response, created_at) "
+                        "VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM turns WHERE session_id = ?), ?, ?, ?)",
+                        (session_id, session_id, user_input, ai_response, created_at)
+                    )
+                elif kind == "summary":
+                    _, _, summary, folded_turns = op
+                    conn.execute(
+                        "INSERT OR REPLACE INTO summaries (session_id, summary, folded_turns) VALUES (?, ?, ?)",
+                        (session_id, summary, folded_turns)
+                    )
+                elif kind == "delete":
+                    conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                    conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+            versions = {
+                session_id: conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM turns WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+                for session_id in {op[1] for op in batch}
+            }
+            conn.execute("COMMIT")
+            return versions
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def flush(self):
+        """Block until every queued write is committed."""
+        self._queue.join()
+    
+    def close(self):
+        if self._closed:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        with self._committed:
+            self._closed = True
+            self._committed.notify_all()
+        with self._read_lock:
+            self._read_conn.close()
+        logger.info("SQLite session backend closed")
+
+
+def create_backend(name=SESSION_BACKEND):
+    """Create the session backend selected by SESSION_BACKEND."""
+    if name == "sqlite":
+        return SQLiteSessionBackend()
+    if name != "memory":
+        logger.warning(f"Unknown session backend '{name}', using in-process memory")
+    return SessionBackend()
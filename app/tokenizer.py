@@ -0,0 +1,50 @@
+import re
+from typing import NamedTuple
+
+# Compiled character-class scans; each stops at its first match, and messages
+# without digits (most chat traffic) never reach the expression check.
+_DIGIT_RE = re.compile(r"\d")
+_OPERATOR_RE = re.compile(r"[+\-*/%]")
+# "$" (not fullmatch) also accepts one trailing newline, as the calculator always has
+_EXPRESSION_RE = re.compile(r"[\d+\-*/%(). ]+$")
+
+
+class MessageTokens(NamedTuple):
+    """Result of tokenizing a chat message."""
+    has_digits: bool
+    has_operator: bool
+    expression: str  # message without spaces if it only holds digits, operators, parentheses and dots; else None
+    
+    @property
+    def route(self):
+        """'calculator' for messages with digits and an operator, else 'llm'."""
+        return "calculator" if self.has_digits and self.has_operator else "llm"
+
+
+_NO_DIGITS = MessageTokens(False, False, None)
+_NO_DIGITS_OPERATOR = MessageTokens(False, True, None)
+
+
+def tokenize(message):
+    """Classify a message for routing and extract its calculator expression."""
+    has_operator = _OPERATOR_RE.search(message) is not None
+    if _DIGIT_RE.search(message) is None:
+        return _NO_DIGITS_OPERATOR if has_operator else _NO_DIGITS
+    
+    expression = message.replace(" ", "") if has_operator and _EXPRESSION_RE.match(message) else None
+    return MessageTokens(True, has_operator, expression)
+
+
+def route_batch(messages):
+    """Tokenize many messages at once. Returns a list of MessageTokens in input order.
+    
+    Each distinct message is tokenized once; repeats share its MessageTokens.
+    """
+    seen = {}
+    results = []
+    for message in messages:
+        tokens = seen.get(message)
+        if tokens is None:
+            tokens = seen[message] = tokenize(message)
+        results.append(tokens)
+    return results
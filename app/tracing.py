@@ -0,0 +1,176 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+# Request tracing. When disabled, traced() returns functions unchanged and
+# span() hands back a shared no-op context manager.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "256"))
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_traces = deque(maxlen=TRACE_BUFFER_SIZE)  # completed traces, oldest first
+_stage_totals = {}  # span name -> [count, total seconds]
+_stage_lock = threading.Lock()
+
+
+class _NullSpan:
+    """Context manager used when there is nothing to record."""
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "name", "started_at", "spans")
+    
+    def __init__(self, name):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.spans = []  # finished spans, in completion order
+
+
+class _Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start", "end", "error", "_token")
+    
+    def __init__(self, trace, name, parent_id):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent_id
+        self.error = None
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            pass  # async generator closed from another context
+        self.trace.spans.append(self)
+        if self.parent_id is None:
+            _finish_trace(self.trace, self)
+        return False
+
+
+def _finish_trace(trace, root):
+    _traces.append((trace, root))
+    with _stage_lock:
+        for finished in trace.spans:
+            totals = _stage_totals.setdefault(finished.name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += finished.end - finished.start
+
+
+def start_trace(name):
+    """Open a request trace; spans started inside it nest under its trace ID."""
+    if not TRACING_ENABLED:
+        return _NULL_SPAN
+    return _Span(_Trace(name), name, None)
+
+
+def span(name):
+    """Time a stage of the current request. Does nothing outside a trace."""
+    if not TRACING_ENABLED:
+        return _NULL_SPAN
+    parent = _current_span.get()
+    if parent is None:
+        return _NULL_SPAN
+    return _Span(parent.trace, name, parent.span_id)
+
+
+def current_trace_id():
+    parent = _current_span.get()
+    return parent.trace.trace_id if parent is not None else None
+
+
+def traced(name=None):
+    """Decorator recording each call of a function (sync, async or async generator) as a span."""
+    def decorate(func):
+        if not TRACING_ENABLED:
+            return func
+        span_name = name or func.__qualname__
+        
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                with span(span_name):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return async_gen_wrapper
+        
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _span_dict(finished, origin):
+    return {
+        "name": finished.name,
+        "span_id": finished.span_id,
+        "parent_id": finished.parent_id,
+        "start_ms": round((finished.start - origin) * 1000, 3),
+        "duration_ms": round((finished.end - finished.start) * 1000, 3),
+        "error": finished.error
+    }
+
+
+def get_traces(limit=20):
+    """Return the most recent completed traces and the aggregate time per stage."""
+    recent = list(_traces)[-limit:] if limit > 0 else []
+    traces = []
+    for trace, root in reversed(recent):
+        spans = sorted(trace.spans, key=lambda finished: finished.start)
+        traces.append({
+            "trace_id": trace.trace_id,
+            "name": trace.name,
+            "started_at": trace.started_at,
+            "duration_ms": round((root.end - root.start) * 1000, 3),
+            "spans": [_span_dict(finished, root.start) for finished in spans]
+        })
+    
+    with _stage_lock:
+        stages = {
+            name: {
+                "count": count,
+                "total_ms": round(total * 1000, 3),
+                "average_ms": round(total / count * 1000, 3)
+            }
+            for name, (count, total) in sorted(_stage_totals.items(), key=lambda item: -item[1][1])
+        }
+    
+    return {
+        "enabled": TRACING_ENABLED,
+        "buffer_size": TRACE_BUFFER_SIZE,
+        "traces": traces,
+        "stages": stages
+    }
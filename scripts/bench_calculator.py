@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Benchmark the AST calculator engine against the previous eval() path."""
+
+import re
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.calculator import evaluate_expression, compile_expression
+import app.calculator as calculator
+
+ITERATIONS = 20000
+EXPRESSIONS = [
+    "15 + 27",
+    "100 * 50",
+    "50 / 10",
+    "(3 + 4) * 2 - 8 / 4",
+    "2 ** 10 % 7",
+    "3.5 * (2 - 0.25) // 1.5",
+]
+HOSTILE = [
+    "9**9**9**9",
+    "(10**999)*(10**999)",
+    "+".join(["1"] * 500),
+]
+
+
+def eval_path(text):
+    """Evaluation path used before the AST engine."""
+    text = text.replace(" ", "")
+    if not re.match(r"^[\d\.\+\-\*/%\(\)\.]+$", text):
+        return None
+    try:
+        return eval(text)
+    except Exception:
+        return None
+
+
+def run(label, func):
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        func(EXPRESSIONS[i % len(EXPRESSIONS)])
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / ITERATIONS * 1e6
+    print(f"{label:<28} {per_call_us:8.2f} us/expression")
+    return per_call_us
+
+
+if __name__ == "__main__":
+    # Keep log I/O out of the measurement
+    calculator.logger.disabled = True
+
+    print("\n" + "=" * 70)
+    print(f"CALCULATOR ENGINE ({ITERATIONS} evaluations)")
+    print("=" * 70)
+
+    for expr in EXPRESSIONS:
+        assert evaluate_expression(expr) == eval_path(expr), expr
+
+    before = run("before (eval)", eval_path)
+    compile_expression.cache_clear()
+    after = run("after (AST, memo cache)", evaluate_expression)
+    print("-" * 70)
+    print(f"Speedup: {before / after:.1f}x")
+    print(f"Memo cache: {compile_expression.cache_info()}")
+
+    print("\nHostile inputs (rejected by cost limits; eval() would stall):")
+    for expr in HOSTILE:
+        start = time.perf_counter()
+        result = evaluate_expression(expr)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(f"  {expr[:30]:<32} -> {result} in {elapsed_ms:.2f}ms")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Benchmark batch (vectorized) calculation against evaluating expressions one by one."""
+
+import random
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import app.calculator as calculator
+from app.calculator import evaluate_batch, evaluate_expression
+
+ITEMS = 1_000_000
+SCALAR_ITEMS = 50_000
+SHAPES = [
+    "{a} + {b}",
+    "{a} * {b} - {c}",
+    "({a} + {b}) / {c}",
+    "{a} ** 2 % {b}",
+    "{x} * ({a} - {y}) // {b}",
+]
+
+
+def expressions(count, seed=0):
+    """Mostly well-formed arithmetic, with division by zero wherever b or c is 0."""
+    rng = random.Random(seed)
+    return [
+        SHAPES[i % len(SHAPES)].format(
+            a=rng.randint(1, 10 ** 6), b=rng.randint(0, 1000), c=rng.randint(0, 99),
+            x=f"{rng.random() * 100:.2f}", y=f"{rng.random():.3f}"
+        )
+        for i in range(count)
+    ]
+
+
+def report(label, count, elapsed):
+    print(f"{label:<24} {elapsed / count * 1e6:8.2f} us/expression  {count / elapsed * 60 / 1e6:8.2f}M expressions/min")
+    return count / elapsed
+
+
+if __name__ == "__main__":
+    # Keep log I/O out of the measurement
+    calculator.logger.disabled = True
+    
+    print("\n" + "=" * 70)
+    print(f"BATCH CALCULATOR ({ITEMS:,} expressions, {len(SHAPES)} shapes)")
+    print("=" * 70)
+    
+    batch = expressions(ITEMS)
+    scalar = batch[:SCALAR_ITEMS]
+    
+    start = time.perf_counter()
+    expected = [evaluate_expression(expression) for expression in scalar]
+    before = report("one by one", len(scalar), time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    results, stats = evaluate_batch(batch)
+    after = report("evaluate_batch", len(batch), time.perf_counter() - start)
+    
+    assert results[:SCALAR_ITEMS] == expected
+    print("-" * 70)
+    print(f"Speedup: {after / before:.1f}x ({stats['vectorized']:,} vectorized, {stats['scalar']:,} scalar)")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Benchmark per-request overhead of the compiled LangGraph graph vs direct dispatch on the calculator route."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.graph import build_graph, build_dispatcher, calculator_node, router_node
+
+ITERATIONS = 5000
+MESSAGES = ["15 + 27", "(3 + 4) * 2 - 8 / 4", "100 * 50", "What is 10 + 5?"]
+
+
+def initial_state(i):
+    return {
+        "session_id": f"bench-{i % 100}",
+        "message": MESSAGES[i % len(MESSAGES)],
+        "response": "",
+        "route": "",
+        "prompt_variant": "professional",
+        "use_cache": True
+    }
+
+
+async def run(label, invoke):
+    for i in range(100):  # warm up
+        await invoke(initial_state(i))
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        await invoke(initial_state(i))
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / ITERATIONS * 1e6
+    print(f"{label:<24} {per_call_us:9.1f} us/request  ({ITERATIONS / elapsed:,.0f} req/s)")
+    return per_call_us
+
+
+async def nodes_only(state):
+    return calculator_node(router_node(state))
+
+
+async def main():
+    print("\n" + "=" * 70)
+    print(f"CALCULATOR DISPATCH ({ITERATIONS} requests)")
+    print("=" * 70)
+    
+    graph = build_graph()
+    dispatcher = build_dispatcher()
+    for i in range(len(MESSAGES)):
+        assert (await graph.ainvoke(initial_state(i)))["response"] == (await dispatcher.ainvoke(initial_state(i)))["response"]
+    
+    work = await run("nodes only", nodes_only)
+    before = await run("LangGraph ainvoke", graph.ainvoke)
+    after = await run("direct dispatch", dispatcher.ainvoke)
+    print("-" * 70)
+    print(f"Overhead per request: {before - work:.1f} us -> {after - work:.1f} us")
+    print(f"Speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
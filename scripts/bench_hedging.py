@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Benchmark hedged LLM requests against a fake backend.
+
+Drives app.resilience.UpstreamPolicy directly, with a backend that sleeps for
+a lognormal latency like scripts/gemini_stub.py, so no server or API key is
+needed. Each mode runs the same latency sequence and reports p50/p95/p99
+request latency, the hedge delay the policy settled on, the share of requests
+that were hedged and the upstream attempts per request.
+
+"success-only" is the policy as it was before cancelled attempts were
+recorded: attempts that lose the hedge race are dropped from the latency
+samples, so the hedge delay drifts down and the hedge rate up.
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.resilience import UpstreamPolicy
+
+
+class SuccessOnlyPolicy(UpstreamPolicy):
+    """UpstreamPolicy that records only attempts that finished."""
+
+    async def _timed(self, call, observe=True):
+        self.attempts += 1
+        start = time.monotonic()
+        result = await call()
+        self.latency.observe(time.monotonic() - start)
+        return result
+
+
+MODES = [
+    ("no hedging", lambda: UpstreamPolicy(hedge_enabled=False)),
+    ("success-only", lambda: SuccessOnlyPolicy(hedge_enabled=True)),
+    ("hedged", lambda: UpstreamPolicy(hedge_enabled=True)),
+]
+
+
+def latencies(count, mean_ms, sigma, seed):
+    """Lognormal attempt latencies in seconds with the given mean."""
+    rng = random.Random(seed)
+    mean = mean_ms / 1000
+    mu = math.log(mean) - sigma ** 2 / 2
+    return [rng.lognormvariate(mu, sigma) for _ in range(count)]
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(policy, draws, requests, concurrency):
+    """Send `requests` calls through policy; return the sorted request latencies."""
+    async def backend():
+        await asyncio.sleep(next(draws))
+        return "ok"
+
+    results = []
+    queue = iter(range(requests))
+
+    async def worker():
+        for _ in queue:
+            start = time.monotonic()
+            await policy.call(backend)
+            results.append(time.monotonic() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return sorted(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--warmup", type=int, default=2000, help="Requests sent before measuring, to settle the hedge delay")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Mean backend latency")
+    parser.add_argument("--sigma", type=float, default=1.0, help="Lognormal shape; larger means a longer tail")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # Enough draws for every attempt, hedges included; each mode sees the same sequence
+    samples = latencies((args.warmup + args.requests) * 2, args.latency_ms, args.sigma, args.seed)
+
+    print("\n" + "=" * 92)
+    print(f"HEDGED REQUESTS ({args.requests} requests after {args.warmup} warmup, concurrency {args.concurrency}, "
+          f"lognormal mean {args.latency_ms:.0f} ms sigma {args.sigma})")
+    print("=" * 92)
+    print(f"{'':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'delay ms':>11}{'hedged':>10}{'attempts':>11}")
+    p99 = {}
+    for label, factory in MODES:
+        policy = factory()
+        draws = iter(samples)
+        asyncio.run(run(policy, draws, args.warmup, args.concurrency))
+        policy.hedges = policy.attempts = 0
+        ordered = asyncio.run(run(policy, draws, args.requests, args.concurrency))
+        p99[label] = percentile(ordered, 0.99)
+        delay = policy.latency.hedge_delay() if policy.hedge_enabled else None
+        print(f"{label:<14}"
+              f"{percentile(ordered, 0.50) * 1000:>10.1f}"
+              f"{percentile(ordered, 0.95) * 1000:>10.1f}"
+              f"{p99[label] * 1000:>10.1f}"
+              f"{(f'{delay * 1000:.1f}' if delay is not None else '-'):>11}"
+              f"{policy.hedges / args.requests:>10.1%}"
+              f"{policy.attempts / args.requests:>11.2f}")
+
+    print("-" * 92)
+    print(f"p99: {p99['no hedging'] / p99['hedged']:.1f}x lower with hedging")
+
+
+if __name__ == "__main__":
+    main()
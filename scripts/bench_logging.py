@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Benchmark request-path logging cost in file mode vs queue mode."""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+RECORDS = 5000
+LINES_PER_REQUEST = 20  # roughly what one /chat request logs across modules
+
+
+def measure():
+    """Log like a request would and return microseconds per record."""
+    from app.logging_utils import setup_logger
+    logger = setup_logger("bench.logging", os.path.join(os.environ["BENCH_LOG_DIR"], "bench.log"))
+    start = time.perf_counter()
+    for i in range(RECORDS):
+        if i % LINES_PER_REQUEST == 0:
+            logger.info("=" * 70)
+        logger.info(f"[session-{i % 50}] LLM NODE OUTPUT: {'x' * 150}...")
+    elapsed = time.perf_counter() - start
+    return elapsed / RECORDS * 1e6
+
+
+def run(mode):
+    with tempfile.TemporaryDirectory() as log_dir:
+        env = dict(os.environ, LOG_MODE=mode, BENCH_LOG_DIR=log_dir, LOG_JSON_FILE=os.path.join(log_dir, "app.jsonl"))
+        output = subprocess.run(
+            [sys.executable, __file__, "--measure"],
+            env=env, cwd=log_dir, capture_output=True, text=True, check=True
+        ).stdout
+    per_record_us = float(output.strip())
+    print(f"{mode:<8} {per_record_us:8.2f} us/record on the request path")
+    return per_record_us
+
+
+if __name__ == "__main__":
+    if "--measure" in sys.argv:
+        print(measure())
+        sys.exit(0)
+    
+    print("\n" + "=" * 70)
+    print(f"LOGGING ({RECORDS} records)")
+    print("=" * 70)
+    
+    before = run("file")
+    after = run("queue")
+    print("-" * 70)
+    print(f"Speedup: {before / after:.1f}x")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Benchmark session history: CompactHistory vs LangChain ConversationBufferMemory.
+
+Reports heap bytes per session (tracemalloc) and the time of one turn, that
+is saving the new messages and rendering the history for the prompt, at
+several conversation lengths. The LangChain side is skipped if langchain
+is not installed.
+"""
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.memory import CompactHistory
+
+SESSIONS = 1000
+TURNS = 20
+DEPTHS = [10, 50, 200]
+RENDER_ITERATIONS = 200
+
+
+def compact_history():
+    return CompactHistory()
+
+
+def langchain_memory():
+    from langchain.memory import ConversationBufferMemory
+    return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+
+
+def turn(session, i):
+    # Fresh strings per session, so nothing is shared between sessions
+    user_input = f"Session {session} question {i}: what is {i} + {session}?"
+    ai_response = f"Session {session} answer {i}: " + "the result follows from the numbers above. " * 8
+    return {"input": user_input}, {"output": ai_response}
+
+
+def bytes_per_session(factory):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = []
+    for session in range(SESSIONS):
+        memory = factory()
+        for i in range(TURNS):
+            memory.save_context(*turn(session, i))
+        sessions.append(memory)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / SESSIONS
+
+
+def turn_time(factory, depth):
+    """Seconds to save one turn and render the history, after depth - 1 earlier turns."""
+    total = 0.0
+    for iteration in range(RENDER_ITERATIONS):
+        memory = factory()
+        for i in range(depth - 1):
+            memory.save_context(*turn(iteration, i))
+        inputs, outputs = turn(iteration, depth)
+        start = time.perf_counter()
+        memory.save_context(inputs, outputs)
+        f"Previous context:\n{memory.buffer}"  # as app.graph builds the prompt
+        total += time.perf_counter() - start
+    return total / RENDER_ITERATIONS
+
+
+def main():
+    implementations = [("CompactHistory", compact_history)]
+    try:
+        langchain_memory()
+        implementations.insert(0, ("ConversationBufferMemory", langchain_memory))
+    except ImportError:
+        print("langchain not installed; measuring CompactHistory only")
+    
+    print("\n" + "=" * 70)
+    print(f"SESSION MEMORY ({SESSIONS} sessions x {TURNS} turns)")
+    print("=" * 70)
+    sizes = {}
+    for label, factory in implementations:
+        sizes[label] = bytes_per_session(factory)
+        print(f"{label:<26} {sizes[label]:>10,.0f} bytes/session")
+    
+    print("\n" + "=" * 70)
+    print(f"PER-TURN SAVE + RENDER (mean of {RENDER_ITERATIONS})")
+    print("=" * 70)
+    print(f"{'':<26}" + "".join(f"{f'{depth} turns':>14}" for depth in DEPTHS))
+    times = {}
+    for label, factory in implementations:
+        times[label] = [turn_time(factory, depth) for depth in DEPTHS]
+        print(f"{label:<26}" + "".join(f"{seconds * 1e6:>11.1f} us" for seconds in times[label]))
+    
+    if len(implementations) == 2:
+        print("-" * 70)
+        print(f"Memory: {sizes['ConversationBufferMemory'] / sizes['CompactHistory']:.1f}x smaller")
+        for depth, before, after in zip(DEPTHS, times["ConversationBufferMemory"], times["CompactHistory"]):
+            print(f"Turn at {depth} turns: {before / after:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Benchmark the shared tokenizer against the previous router/calculator scans, and route_batch."""
+
+import re
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.tokenizer import tokenize, route_batch
+
+ITERATIONS = 50000
+MESSAGES = [
+    "15 + 27",
+    "What is the capital of France?",
+    "(3 + 4) * 2 - 8 / 4",
+    "Can you explain how photosynthesis works in simple terms?",
+    "100 * 50",
+    "Tell me about well-known Python web frameworks.",
+    "What is 10 + 5?",
+    "Hello, how are you today?",
+]
+# Inputs where anchoring and whitespace matter; routes and expressions must not change
+EDGE_CASES = ["2+2\n", "2+2\n\n", "\n2+2", "2 + 2 ", "2+2\t", "(1+2)*3\n", "5 / 0\n"]
+_OLD_EXPRESSION_RE = re.compile(r"^[\d\.\+\-\*/%\(\)\.]+$")
+
+
+def old_path(message):
+    """Scans done before the tokenizer: router, is_math_expression, then the expression check."""
+    lowered = message.lower()
+    route = "llm"
+    if any(op in lowered for op in ['+', '-', '*', '/', '%', '**']):
+        if any(char.isdigit() for char in lowered):
+            route = "calculator"
+    if route == "calculator":
+        has_numbers = any(c.isdigit() for c in message)
+        has_operators = any(op in message for op in ['+', '-', '*', '/', '%', '**'])
+        if has_numbers and has_operators:
+            text = message.replace(" ", "")
+            return route, text if _OLD_EXPRESSION_RE.match(text) else None
+    return route, None
+
+
+def new_path(message):
+    tokens = tokenize(message)
+    return tokens.route, tokens.expression
+
+
+def run(label, func):
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        func(MESSAGES[i % len(MESSAGES)])
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / ITERATIONS * 1e6
+    print(f"{label:<28} {per_call_us:8.2f} us/message  ({ITERATIONS / elapsed:,.0f} msg/s)")
+    return per_call_us
+
+
+if __name__ == "__main__":
+    print("\n" + "=" * 70)
+    print(f"ROUTER TOKENIZER ({ITERATIONS} messages)")
+    print("=" * 70)
+    
+    for message in MESSAGES + EDGE_CASES:
+        assert old_path(message) == new_path(message), message
+    
+    before = run("before (separate scans)", old_path)
+    after = run("after (tokenizer)", new_path)
+    print("-" * 70)
+    print(f"Speedup: {before / after:.1f}x")
+    
+    batch = (MESSAGES + EDGE_CASES) * (ITERATIONS // (len(MESSAGES) + len(EDGE_CASES)))
+    assert route_batch(batch) == [tokenize(message) for message in batch]
+    start = time.perf_counter()
+    one_by_one = [tokenize(message).route for message in batch]
+    before = time.perf_counter() - start
+    start = time.perf_counter()
+    routes = [tokens.route for tokens in route_batch(batch)]
+    after = time.perf_counter() - start
+    assert routes == one_by_one
+    print(f"\nroute_batch: {len(routes)} messages ({len(set(batch))} distinct) in {after * 1000:.1f}ms "
+          f"vs {before * 1000:.1f}ms one by one ({before / after:.1f}x)")
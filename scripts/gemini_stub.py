@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Local stand-in for GeminiChainWrapper, for load tests without an API key."""
+
+import asyncio
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from google.api_core import exceptions as google_exceptions
+from app.llm import LLMResponse
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class StubUpstreamError(google_exceptions.ServiceUnavailable):
+    """Injected failure standing in for a transient Gemini API error."""
+
+
+class StubGeminiChainWrapper:
+    """Answers like GeminiChainWrapper with simulated latency, errors and response sizes."""
+    
+    def __init__(self, latency_ms=300.0, distribution="lognormal", sigma=0.5,
+                 error_rate=0.0, response_chars=400, chunks=8, seed=None):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{distribution}'")
+        self.model_name = "gemini-stub"
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.response_chars = response_chars
+        self.chunks = max(1, chunks)
+        self._random = random.Random(seed)
+        self.calls = 0
+    
+    def sample_latency(self):
+        """Draw one call latency in seconds."""
+        mean = self.latency_ms / 1000
+        if self.distribution == "fixed":
+            return mean
+        if self.distribution == "uniform":
+            return self._random.uniform(0, 2 * mean)
+        if self.distribution == "exponential":
+            return self._random.expovariate(1 / mean) if mean > 0 else 0.0
+        # lognormal with the requested mean
+        mu = math.log(mean) - self.sigma ** 2 / 2 if mean > 0 else 0.0
+        return self._random.lognormvariate(mu, self.sigma) if mean > 0 else 0.0
+    
+    def _response_text(self, prompt_text):
+        text = f"Stub answer ({len(prompt_text)} prompt chars). "
+        filler = "lorem ipsum dolor sit amet "
+        while len(text) < self.response_chars:
+            text += filler
+        return text[:self.response_chars]
+    
+    def _maybe_fail(self):
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise StubUpstreamError("Injected stub upstream error")
+    
+    async def aping(self, timeout=10):
+        await asyncio.sleep(0)
+    
+    def invoke(self, inputs):
+        self.calls += 1
+        time.sleep(self.sample_latency())
+        self._maybe_fail()
+        return LLMResponse(self._response_text(inputs.get("input", "")))
+    
+    async def ainvoke(self, inputs):
+        self.calls += 1
+        await asyncio.sleep(self.sample_latency())
+        self._maybe_fail()
+        return LLMResponse(self._response_text(inputs.get("input", "")))
+    
+    async def astream(self, inputs):
+        self.calls += 1
+        text = self._response_text(inputs.get("input", ""))
+        delay = self.sample_latency() / self.chunks
+        size = math.ceil(len(text) / self.chunks) or 1
+        for start in range(0, len(text), size):
+            await asyncio.sleep(delay)
+            if start == 0:
+                self._maybe_fail()
+            yield text[start:start + size]
+
+
+def install_stub(**options):
+    """Replace the process-wide Gemini client with a stub and return it."""
+    import app.llm as llm
+    stub = StubGeminiChainWrapper(**options)
+    with llm._llm_lock:
+        llm._llm_instance = stub
+        llm._chains.clear()
+    return stub
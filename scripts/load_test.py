@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""Load-test the chat service against a local Gemini stub at stepped concurrency.
+
+Starts the FastAPI app in a subprocess with StubGeminiChainWrapper in place of
+Gemini, drives /chat with a mix of calculator and LLM messages, and reports
+throughput, latency percentiles and error rate per concurrency level.
+
+    python scripts/load_test.py --levels 1,8,32 --duration 10 --output results.json
+    python scripts/load_test.py --baseline results.json   # compare against a saved run
+    python scripts/load_test.py --hedge --baseline results.json   # hedged LLM requests
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import requests
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,4,16,64", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--calc-ratio", type=float, default=0.3, help="share of calculator messages")
+    parser.add_argument("--turns-per-session", type=int, default=5, help="turns before a worker starts a new session")
+    parser.add_argument("--use-cache", action="store_true", help="allow LLM response cache hits")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="mean stub latency")
+    parser.add_argument("--latency-dist", default="lognormal", help="fixed, uniform, exponential or lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal shape")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of stub calls that fail")
+    parser.add_argument("--response-chars", type=int, default=400, help="stub response size")
+    parser.add_argument("--hedge", action="store_true", help="enable hedged LLM requests in the server")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--port", type=int, default=0, help="server port (default: a free port)")
+    parser.add_argument("--output", default=None, help="write results JSON here")
+    parser.add_argument("--baseline", default=None, help="results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail if p95 latency or throughput regresses by more than this share")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def serve(args):
+    """Run the app with the Gemini stub installed (child process)."""
+    import uvicorn
+    from gemini_stub import install_stub
+    from app.main import app
+    
+    install_stub(
+        latency_ms=args.latency_ms,
+        distribution=args.latency_dist,
+        sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        response_chars=args.response_chars,
+        seed=args.seed
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args):
+    """Start the stubbed service and wait until /ready answers."""
+    command = [sys.executable, __file__, "--serve"] + [a for a in sys.argv[1:] if a != "--serve"]
+    command += ["--port", str(args.port)]
+    env = dict(os.environ, GEMINI_API_KEY=os.getenv("GEMINI_API_KEY", "stub"))
+    if args.hedge:
+        env["LLM_HEDGE_ENABLED"] = "true"
+    process = subprocess.Popen(command, cwd=project_root, env=env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/ready", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not become ready within 60s")
+
+
+def make_message(rng, counter):
+    """Return (kind, message) following the configured traffic mix."""
+    if rng.random() < ARGS.calc_ratio:
+        return "calculator", f"{rng.randint(1, 999)} * {rng.randint(1, 99)} + {counter}"
+    return "llm", f"Tell me one fact about topic {uuid.uuid4().hex[:8]}."
+
+
+def worker(base_url, level, index, deadline, results):
+    rng = random.Random(None if ARGS.seed is None else ARGS.seed * 1000 + index)
+    session = requests.Session()
+    turn = 0
+    session_id = f"load-{level}-{index}-0"
+    while time.time() < deadline:
+        if turn and turn % ARGS.turns_per_session == 0:
+            session_id = f"load-{level}-{index}-{turn}"
+        kind, message = make_message(rng, turn)
+        turn += 1
+        payload = {"session_id": session_id, "message": message, "use_cache": ARGS.use_cache}
+        start = time.perf_counter()
+        try:
+            ok = session.post(f"{base_url}/chat", json=payload, timeout=120).status_code == 200
+        except requests.RequestException:
+            ok = False
+        results.append((kind, ok, time.perf_counter() - start))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    rank = q * (len(sorted_values) - 1)
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(level, results, elapsed):
+    latencies = sorted(latency for _, ok, latency in results if ok)
+    errors = sum(1 for _, ok, _ in results if not ok)
+    by_kind = {}
+    for kind, ok, latency in results:
+        by_kind[kind] = by_kind.get(kind, 0) + 1
+    return {
+        "concurrency": level,
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": errors / len(results) if results else 0.0,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": latencies[-1] * 1000 if latencies else 0.0
+        },
+        "mix": by_kind
+    }
+
+
+def run_level(base_url, level):
+    results = []
+    deadline = time.time() + ARGS.duration
+    threads = [threading.Thread(target=worker, args=(base_url, level, i, deadline, results)) for i in range(level)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(level, results, time.perf_counter() - start)
+
+
+def compare(levels, baseline_path, max_regression):
+    """Print changes against a baseline run; return False on a regression."""
+    baseline = {level["concurrency"]: level for level in json.loads(Path(baseline_path).read_text())["levels"]}
+    passed = True
+    print("\nCompared with baseline:")
+    for level in levels:
+        before = baseline.get(level["concurrency"])
+        if before is None:
+            continue
+        rps_change = (level["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] if before["throughput_rps"] else 0.0
+        p95_change = (level["latency_ms"]["p95"] - before["latency_ms"]["p95"]) / before["latency_ms"]["p95"] if before["latency_ms"]["p95"] else 0.0
+        regressed = rps_change < -max_regression or p95_change > max_regression
+        passed = passed and not regressed
+        print(f"  c={level['concurrency']:<4} throughput {rps_change:+.1%}  p95 {p95_change:+.1%}  {'REGRESSION' if regressed else 'ok'}")
+    return passed
+
+
+def main():
+    if ARGS.serve:
+        serve(ARGS)
+        return 0
+    
+    if not ARGS.port:
+        ARGS.port = free_port()
+    levels = [int(level) for level in ARGS.levels.split(",")]
+    
+    print("\n" + "=" * 70)
+    print(f"LOAD TEST: levels {levels}, {ARGS.duration:.0f}s each, {ARGS.calc_ratio:.0%} calculator")
+    print(f"Stub: {ARGS.latency_dist} {ARGS.latency_ms:.0f}ms, error rate {ARGS.error_rate:.1%}, {ARGS.response_chars} chars"
+          f"{', hedged' if ARGS.hedge else ''}")
+    print("=" * 70)
+    
+    process, base_url = start_server(ARGS)
+    try:
+        requests.post(f"{base_url}/chat", json={"session_id": "warmup", "message": "hello"}, timeout=60)
+        summaries = []
+        print(f"{'conc':>5} {'req':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for level in levels:
+            summary = run_level(base_url, level)
+            summaries.append(summary)
+            latency = summary["latency_ms"]
+            print(f"{level:>5} {summary['requests']:>7} {summary['throughput_rps']:>8.1f} "
+                  f"{latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f} {summary['error_rate']:>7.1%}")
+    finally:
+        process.terminate()
+        process.wait()
+    
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(ARGS).items() if key not in ("serve", "output", "baseline", "port")},
+        "levels": summaries
+    }
+    if ARGS.output:
+        Path(ARGS.output).write_text(json.dumps(results, indent=2))
+        print(f"\nResults saved to {ARGS.output}")
+    
+    if ARGS.baseline and not compare(summaries, ARGS.baseline, ARGS.max_regression):
+        return 1
+    return 0
+
+
+ARGS = parse_args()
+
+if __name__ == "__main__":
+    sys.exit(main())
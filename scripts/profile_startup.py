@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""Break down import and startup time of the service by module and phase.
+
+Each measurement runs in a fresh interpreter so nothing is cached:
+
+- import time of `app.main` and `app.graph`, grouped by top-level package and
+  per app module (from `python -X importtime`)
+- startup phases: importing app.main, importing the graph, compiling it and
+  creating the Gemini client
+
+    python scripts/profile_startup.py --output startup.json
+    python scripts/profile_startup.py --baseline startup.json   # compare against a saved run
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per measurement (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="packages to list")
+    parser.add_argument("--output", default=None, help="write results JSON here")
+    parser.add_argument("--baseline", default=None, help="results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail if a phase gets slower by more than this share")
+    parser.add_argument("--phases", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def measure_phases():
+    """Time the startup phases in this (fresh) interpreter and print them as JSON (child process)."""
+    phases = {}
+    start = time.perf_counter()
+    import app.main  # noqa: F401
+    phases["import app.main"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    from app import graph
+    phases["import app.graph"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    graph.get_graph()
+    phases["compile graph"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    from app.llm import get_chain
+    get_chain()
+    phases["create LLM client"] = time.perf_counter() - start
+    print(json.dumps(phases))
+
+
+def child_env():
+    # A placeholder key lets the Gemini client be built; nothing is sent upstream
+    return dict(os.environ, GEMINI_API_KEY=os.getenv("GEMINI_API_KEY", "profile-startup"))
+
+
+def run_phases():
+    output = subprocess.run(
+        [sys.executable, __file__, "--phases"],
+        cwd=project_root, env=child_env(), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_importtime():
+    """Return {module: (self seconds, cumulative seconds)} for importing app.main and app.graph."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main, app.graph"],
+        cwd=project_root, env=child_env(), capture_output=True, text=True, check=True
+    ).stderr
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return modules
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def summarize_imports(runs):
+    """Median self time per top-level package and cumulative time per app module."""
+    packages, app_modules = {}, {}
+    for modules in runs:
+        by_package = {}
+        for name, (self_seconds, cumulative) in modules.items():
+            package = name.split(".")[0]
+            by_package[package] = by_package.get(package, 0.0) + self_seconds
+            if package == "app":
+                app_modules.setdefault(name, []).append(cumulative)
+        for package, seconds in by_package.items():
+            packages.setdefault(package, []).append(seconds)
+    return (
+        {package: median(values) for package, values in packages.items()},
+        {name: median(values) for name, values in app_modules.items()}
+    )
+
+
+def compare(phases, baseline_path, max_regression):
+    """Print phase changes against a baseline run; return False on a regression."""
+    baseline = json.loads(Path(baseline_path).read_text())["phases"]
+    passed = True
+    print("\nCompared with baseline:")
+    for phase, seconds in phases.items():
+        before = baseline.get(phase)
+        if not before:
+            continue
+        change = (seconds - before) / before
+        # Ignore noise on phases that take only a few milliseconds
+        regressed = change > max_regression and seconds - before > 0.01
+        passed = passed and not regressed
+        print(f"  {phase:<20} {before * 1000:8.0f}ms -> {seconds * 1000:8.0f}ms  {change:+.1%}  {'REGRESSION' if regressed else 'ok'}")
+    return passed
+
+
+def main():
+    if ARGS.phases:
+        measure_phases()
+        return 0
+    
+    print("\n" + "=" * 70)
+    print(f"STARTUP PROFILE ({ARGS.runs} runs, median)")
+    print("=" * 70)
+    
+    phase_runs = [run_phases() for _ in range(ARGS.runs)]
+    phases = {phase: median([run[phase] for run in phase_runs]) for phase in phase_runs[0]}
+    packages, app_modules = summarize_imports([run_importtime() for _ in range(ARGS.runs)])
+    
+    print(f"{'phase':<20} {'ms':>9}")
+    for phase, seconds in phases.items():
+        print(f"{phase:<20} {seconds * 1000:>9.1f}")
+    print(f"{'total':<20} {sum(phases.values()) * 1000:>9.1f}")
+    
+    print(f"\nImport of app.main and app.graph by package (self time, top {ARGS.top}):")
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:ARGS.top]:
+        print(f"  {package:<30} {seconds * 1000:>9.1f} ms")
+    print("\nApp modules (cumulative, including what they import):")
+    for name, seconds in sorted(app_modules.items(), key=lambda item: -item[1]):
+        print(f"  {name:<30} {seconds * 1000:>9.1f} ms")
+    
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "phases": phases,
+        "import_by_package": packages,
+        "import_by_app_module": app_modules
+    }
+    if ARGS.output:
+        Path(ARGS.output).write_text(json.dumps(results, indent=2))
+        print(f"\nResults saved to {ARGS.output}")
+    
+    if ARGS.baseline and not compare(phases, ARGS.baseline, ARGS.max_regression):
+        return 1
+    return 0
+
+
+ARGS = parse_args()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Check that batch (vectorized) calculation matches evaluate_expression() item by item."""
+
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+# A generous per-expression time limit keeps the scalar reference deterministic
+os.environ.setdefault("CALC_TIMEOUT_MS", "1000")
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import app.calculator as calculator
+from app.calculator import batch_result_json, evaluate_batch, evaluate_expression
+
+GROUP_SIZE = 40
+SHAPES = 1500
+EDGE_CASES = [
+    "15 + 27", "(3 + 4) * 2 - 8 / 4", "2 ** 10 % 7", "3.5 * (2 - 0.25) // 1.5",
+    "1 / 0", "5 // 0", "5 % 0", "1.5 / 0.0", "0.0 % 0", "2 ** -1", "0 ** -1", "-7 // 2", "-7 % 3", "7.5 % -2",
+    "2 ** 62", "3037000500 * 3037000500", "999999999999999999 + 999999999999999999",
+    "12345678901234567890 * 2", "9007199254740993 / 1", "007 + 1", "00 + 1", "1.2.3 + 1", "5.", ".5 * 2",
+    "9**9**9**9", "", "abc", "2(3)", "+".join(["1"] * 150),
+    "(-8)**(1/3)", "(-1)**0.5", "(-2.5)**0.5 * 2",
+]
+LITERALS = [
+    lambda rng: "0",
+    lambda rng: "0.0",
+    lambda rng: str(rng.randint(0, 20)),
+    lambda rng: str(rng.randint(10 ** 9, 10 ** 18 - 1)),
+    lambda rng: f"{rng.uniform(0, 50):.3f}",
+    lambda rng: f"{rng.uniform(0, 1) * 10 ** rng.randint(0, 300):.1f}",
+    lambda rng: "9" * rng.randint(150, 309) + ".0",
+]
+
+
+def random_shape(rng, depth=0):
+    if depth > 3 or rng.random() < 0.3:
+        return "#"
+    choice = rng.random()
+    if choice < 0.15:
+        return "-" + random_shape(rng, depth + 1)
+    if choice < 0.25:
+        return "(" + random_shape(rng, depth + 1) + ")"
+    return random_shape(rng, depth + 1) + rng.choice(["+", "-", "*", "/", "//", "%", "**"]) + random_shape(rng, depth + 1)
+
+
+def random_expressions(rng):
+    """Groups of expressions with the same shape and literal kinds, so most are vectorized."""
+    expressions = []
+    for _ in range(SHAPES):
+        pieces = random_shape(rng).split("#")
+        literals = [rng.choice(LITERALS) for _ in pieces[1:]]
+        for _ in range(GROUP_SIZE):
+            expressions.append(pieces[0] + "".join(literal(rng) + piece for literal, piece in zip(literals, pieces[1:])))
+    return expressions
+
+
+def mismatches(expressions):
+    results, stats = evaluate_batch(expressions)
+    wrong = []
+    for expression, result in zip(expressions, results):
+        expected = evaluate_expression(expression)
+        # repr() tells apart 0.0 and -0.0, and compares nan equal to nan
+        if type(result) is not type(expected) or repr(result) != repr(expected):
+            wrong.append((expression, expected, result))
+    return wrong, stats
+
+
+def main():
+    calculator.logger.disabled = True
+    print("\n" + "=" * 70)
+    print("BATCH CALCULATOR vs SCALAR")
+    print("=" * 70 + "\n")
+    
+    passed = total = 0
+    for label, expressions in [
+        ("Edge cases, one group each", EDGE_CASES * 20),
+        ("Edge cases, scalar only", EDGE_CASES),
+        (f"Random shapes ({SHAPES} x {GROUP_SIZE})", random_expressions(random.Random(7))),
+    ]:
+        total += 1
+        wrong, stats = mismatches(expressions)
+        passed += not wrong
+        print(f"{'✓' if not wrong else '✗'} {label}: {stats['vectorized']} vectorized, {stats['scalar']} scalar")
+        for expression, expected, result in wrong[:10]:
+            print(f"  {expression[:60]!r}: scalar {expected!r}, batch {result!r}")
+    
+    total += 1
+    results, _ = evaluate_batch(["1 + 1"] * 20 + ["2 * 3", "1 / 0"])
+    in_order = results == [2] * 20 + [6, None]
+    passed += in_order
+    print(f"{'✓' if in_order else '✗'} Results come back in input order")
+    
+    total += 1
+    results, _ = evaluate_batch(["(-8)**(1/3)", "(-1)**0.5", "1 + 1", "9" * 309 + ".0 * 2", "1 / 0"])
+    try:
+        encoded = json.dumps([batch_result_json(value) for value in results], allow_nan=False)
+        print(f"✓ Complex and non-finite results encode as JSON: {encoded}")
+        passed += 1
+    except (TypeError, ValueError) as e:
+        print(f"✗ Results do not encode as JSON: {e}")
+    
+    print(f"\nBatch calculator tests: {passed}/{total} passed\n")
+    return passed == total
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
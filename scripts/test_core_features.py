@@ -44,6 +44,15 @@ for message, expected_route in test_cases:
 
 print(f"\nRouter tests: {passed}/{len(test_cases)} passed\n")
 
+# Batch routing gives the same routes as one message at a time, in input order
+from app.tokenizer import route_batch
+
+batch = [message for message, _ in test_cases] * 3
+batch_routes = [tokens.route for tokens in route_batch(batch)]
+expected_routes = [route for _, route in test_cases] * 3
+status = "✓" if batch_routes == expected_routes else "✗"
+print(f"{status} route_batch: {len(batch)} messages routed in input order\n")
+
 # Test 2: Calculator node
 print("[Test 2] Calculator Node - Math Expressions")
 print("-" * 70)
@@ -53,6 +62,7 @@ calc_tests = [
     ("10 * 5", "50"),
     ("100 / 4", "25"),
     ("50 - 30", "20"),
+    ("2+2\n", "4"),  # trailing newline, as sent by some clients
 ]
 
 passed_calc = 0
@@ -62,7 +72,7 @@ for expr, expected_result in calc_tests:
     response = result["response"]
     contains_result = expected_result in response
     status = "✓" if contains_result else "✗"
-    print(f"{status} Expression: '{expr}'")
+    print(f"{status} Expression: {expr!r}")
     print(f"  Response: {response}")
     if contains_result:
         passed_calc += 1
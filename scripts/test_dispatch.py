@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Check that direct dispatch answers exactly like the compiled LangGraph graph."""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("GEMINI_API_KEY", "stub")
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from gemini_stub import install_stub
+from app.graph import build_graph, build_dispatcher
+from app.memory import get_memory_context
+
+# Turns per conversation; each conversation runs in its own session on both paths
+CONVERSATIONS = [
+    ["15 + 27", "(3 + 4) * 2 - 8 / 4", "2 ** 10"],
+    ["Hello, my name is Alice", "What is 10 + 5?", "What's my name?"],
+    ["5 / 0", "Tell me about Python", "100 * 50"],
+    ["", "   ", "abc + def"],
+]
+VARIANTS = ["professional", "friendly", "minimal", "unknown"]
+
+
+def initial_state(session_id, message, variant):
+    return {
+        "session_id": session_id,
+        "message": message,
+        "response": "",
+        "route": "",
+        "prompt_variant": variant,
+        "use_cache": False
+    }
+
+
+async def run(runner, prefix, conversation, variant, index):
+    session_id = f"{prefix}-{index}-{variant}"
+    results = []
+    for message in conversation:
+        result = await runner.ainvoke(initial_state(session_id, message, variant))
+        results.append((result["route"], result["response"]))
+    return results, get_memory_context(session_id)
+
+
+async def main():
+    install_stub(latency_ms=0, distribution="fixed")
+    graph = build_graph()
+    dispatcher = build_dispatcher()
+    
+    print("\n" + "=" * 70)
+    print("DIRECT DISPATCH vs LANGGRAPH")
+    print("=" * 70 + "\n")
+    
+    passed = total = 0
+    for index, conversation in enumerate(CONVERSATIONS):
+        for variant in VARIANTS:
+            total += 1
+            expected = await run(graph, "graph", conversation, variant, index)
+            actual = await run(dispatcher, "direct", conversation, variant, index)
+            same = expected == actual
+            passed += same
+            print(f"{'✓' if same else '✗'} Conversation {index} ({variant}): routes {[route for route, _ in actual[0]]}")
+            if not same:
+                print(f"  LangGraph: {expected}")
+                print(f"  Direct:    {actual}")
+    
+    state = initial_state("input-copy", "1 + 1", "professional")
+    await dispatcher.ainvoke(state)
+    total += 1
+    passed += state["response"] == ""
+    print(f"{'✓' if state['response'] == '' else '✗'} Caller's state is left unchanged")
+    
+    print(f"\nEquivalence tests: {passed}/{total} passed\n")
+    return passed == total
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
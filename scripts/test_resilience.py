@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Check that timeouts of a hung Gemini call open the circuit breaker on every call path."""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("GEMINI_API_KEY", "stub")
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from langchain.prompts import PromptTemplate
+import app.llm as llm
+from app.resilience import CircuitBreaker, CircuitOpenError, LLMDeadlineExceeded, deadline_after
+
+MIN_CALLS = 4
+TIMEOUT_SECONDS = 0.05
+
+
+class HungModel:
+    """Gemini stand-in whose calls never return."""
+
+    model_name = "gemini-hung"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, inputs):
+        self.calls += 1
+        await asyncio.Event().wait()
+
+
+async def run_path(label, use_cache, single_flight_enabled):
+    llm.breaker = CircuitBreaker(enabled=True, min_calls=MIN_CALLS, failure_rate=0.5)
+    llm.single_flight.enabled = single_flight_enabled
+    llm.response_cache.clear()
+    model = HungModel()
+    chain = llm.PromptLLMChain(PromptTemplate(input_variables=["input"], template="{input}"), model)
+
+    timeouts = 0
+    for i in range(MIN_CALLS):
+        try:
+            await chain.ainvoke({"input": f"{label} question {i}"}, use_cache=use_cache,
+                                deadline=deadline_after(TIMEOUT_SECONDS))
+        except LLMDeadlineExceeded:
+            timeouts += 1
+
+    rejected = False
+    try:
+        await chain.ainvoke({"input": f"{label} question after"}, use_cache=use_cache,
+                            deadline=deadline_after(TIMEOUT_SECONDS))
+    except CircuitOpenError:
+        rejected = True
+    except LLMDeadlineExceeded:
+        pass
+
+    ok = timeouts == MIN_CALLS and llm.breaker.state == "open" and rejected and model.calls == MIN_CALLS
+    print(f"{'✓' if ok else '✗'} {label}: {timeouts} timeouts, breaker {llm.breaker.state}, "
+          f"next call {'rejected' if rejected else 'sent'}, {model.calls} upstream calls")
+    return ok
+
+
+async def main():
+    paths = [
+        ("use_cache=true", True, True),
+        ("use_cache=false", False, True),
+        ("single flight disabled", True, False),
+    ]
+    results = [await run_path(*path) for path in paths]
+    print(f"\nResilience tests: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)